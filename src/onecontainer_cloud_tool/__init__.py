@@ -1,10 +1,26 @@
-import os
-import pkg_resources
+try:
+    from importlib.metadata import PackageNotFoundError, version as _dist_version
+except ImportError:  # python < 3.8
+    try:
+        from importlib_metadata import PackageNotFoundError, version as _dist_version
+    except ImportError:
+        _dist_version = None
+        PackageNotFoundError = LookupError
+
+
+def _pkg_resources_version(name):
+    """installed version from setuptools, imported only where importlib
+    metadata is missing as the import is slow."""
+    import pkg_resources
+
+    try:
+        return pkg_resources.get_distribution(name).version
+    except pkg_resources.DistributionNotFound:
+        raise PackageNotFoundError(name)
+
 
 try:
-    version = pkg_resources.get_distribution("onecontainer-cloud-tool").version
-except:
+    version = (_dist_version or _pkg_resources_version)("onecontainer-cloud-tool")
+except (PackageNotFoundError, ImportError):
     version = None
 __version__ = version or "0.2.0"
-
-#os.chdir(os.path.dirname(__file__))
@@ -3,15 +3,31 @@ import sys
 
 import click
 
-from onecontainer_cloud_tool.list_instances import render_data
 from onecontainer_cloud_tool.logger import logger
-from onecontainer_cloud_tool.services import service
+from onecontainer_cloud_tool.services import providers, service
 
 from . import __version__
 
-aws = service("aws")
-azure = service("azure")
-gcp = service("gcp")
+# provisioning backends supported by start for each cloud
+BACKENDS = {
+    "aws": ["vm"],
+    "azure": ["vm", "arm-template", "scale-set"],
+    "gcp": ["vm", "instance-group"],
+}
+# start options only some clouds use
+CLOUD_OPTIONS = {
+    "--env": ["azure", "gcp"],
+    "--run-flag": ["azure"],
+    "--extra-image": ["azure"],
+}
+
+
+def _provider(ctx):
+    """build the cloud service picked with --cloud, importing only its SDK."""
+    cloud = ctx.obj.get("cloud", None)
+    if cloud is None:
+        return None
+    return service(cloud)
 
 
 @click.group()
@@ -19,7 +35,7 @@ gcp = service("gcp")
 @click.option(
     "--cloud",
     "-c",
-    type=click.Choice(["aws", "azure", "gcp"]),
+    type=click.Choice(providers()),
     help="Use a cloud service, options are: aws, azure",
 )
 @click.pass_context
@@ -42,6 +58,8 @@ def cli(ctx, cloud=None) -> None:
 )
 def list_instances(cloud):
     """list cloud instances for intel."""
+    from onecontainer_cloud_tool.list_instances import render_data
+
     if cloud is None:
         render_data(cloud="all")
     # fix this once gcp instance list is updated
@@ -50,14 +68,20 @@ def list_instances(cloud):
 
 
 @cli.command("init")
+@click.option(
+    "--subscription",
+    default=None,
+    help="azure: subscription id or name, defaults to the first enabled subscription.",
+)
 @click.pass_context
-def init(ctx, access_key=None, secret_key=None, region=None):
+def init(ctx, subscription, access_key=None, secret_key=None, region=None):
     logger.debug("Initializing service")
+    provider = _provider(ctx)
     if ctx.obj.get("cloud", None) == "aws":
         access_key = click.prompt("access key", hide_input=True)
         secret_key = click.prompt("secret key", hide_input=True)
         region = click.prompt("region", default="us-east-1")
-        aws.initialize(access_key, secret_key, region)
+        provider.initialize(access_key, secret_key, region)
     elif ctx.obj.get("cloud", None) == "gcp":
         access_key_file = click.prompt("service account key file", hide_input=False)
         try:
@@ -67,10 +91,10 @@ def init(ctx, access_key=None, secret_key=None, region=None):
             logger.error("given service account key file location incorrect, exiting.")
             sys.exit(1)
         region = click.prompt("region", default="us-west1-a")
-        gcp.initialize(access_key_file, project_id, region)
+        provider.initialize(access_key_file, project_id, region)
     elif ctx.obj.get("cloud", None) == "azure":
         region = click.prompt("region", default="eastus")
-        azure.initialize(region)
+        provider.initialize(region, subscription=subscription)
 
 
 @cli.command("start")
@@ -81,47 +105,239 @@ def init(ctx, access_key=None, secret_key=None, region=None):
     prompt=True,
     help="container image.",
 )
+@click.option(
+    "--env",
+    "-e",
+    multiple=True,
+    help="KEY=VALUE environment variable of the container, can be repeated (azure, gcp).",
+)
+@click.option(
+    "--run-flag",
+    "run_flags",
+    multiple=True,
+    help="extra docker run flag, can be repeated (azure).",
+)
+@click.option(
+    "--extra-image",
+    "extra_images",
+    multiple=True,
+    help="another container image to run next to the first one, can be repeated (azure).",
+)
+@click.option(
+    "--machine-image",
+    "-mi",
+    default=None,
+    help="machine image, aws defaults to the latest ECS-optimized AMI of the region.",
+)
+@click.option(
+    "--count",
+    "-n",
+    default=1,
+    type=click.IntRange(min=1),
+    help="number of instances to launch (aws, gcp, azure scale-set).",
+)
+@click.option(
+    "--backend",
+    default="vm",
+    type=click.Choice(["vm", "arm-template", "scale-set", "instance-group"]),
+    help="provisioning backend, arm-template deploys azure resources in one template, "
+    "scale-set launches --count azure vms as one scale set, instance-group launches "
+    "--count gcp vms through a managed instance group.",
+)
+@click.option(
+    "--shared-network",
+    is_flag=True,
+    default=False,
+    help="azure: reuse the vnet, subnet and nsg of the onecontainer-shared-<region> resource group.",
+)
+@click.option(
+    "--baked-image/--no-baked-image",
+    default=True,
+    help="azure: boot from the image captured by bake for the region, if there is one.",
+)
+@click.option(
+    "--readiness",
+    default="ecs",
+    type=click.Choice(["ecs", "status-ok"]),
+    help="aws: wait for ECS agent registration or for the EC2 status checks.",
+)
+@click.option(
+    "--poll-interval",
+    default=2.0,
+    type=click.FloatRange(min=0.1),
+    help="aws: initial seconds between readiness polls.",
+)
+@click.option(
+    "--poll-backoff",
+    default=1.5,
+    type=click.FloatRange(min=1.0),
+    help="aws: factor the readiness poll interval grows by.",
+)
 @click.pass_context
-def start(ctx, container_image_url):
+def start(
+    ctx,
+    container_image_url,
+    env,
+    run_flags,
+    extra_images,
+    machine_image,
+    count,
+    backend,
+    shared_network,
+    baked_image,
+    readiness,
+    poll_interval,
+    poll_backoff,
+):
     """start deploying containers on cloud."""
+    cloud = ctx.obj.get("cloud", None)
+    for entry in env:
+        if "=" not in entry:
+            raise click.BadParameter(f"{entry} is not KEY=VALUE", param_hint="--env")
+    if backend not in BACKENDS.get(cloud, ["vm"]):
+        raise click.BadParameter(
+            f"{backend} is not supported for {cloud}", param_hint="--backend"
+        )
+    for option, values in (
+        ("--env", env),
+        ("--run-flag", run_flags),
+        ("--extra-image", extra_images),
+    ):
+        if values and cloud not in CLOUD_OPTIONS[option]:
+            raise click.BadParameter(f"{option} is not supported for {cloud}", param_hint=option)
+    if cloud == "azure" and count > 1 and backend != "scale-set":
+        raise click.BadParameter(
+            "azure launches several instances only with --backend scale-set",
+            param_hint="--count",
+        )
+    provider = _provider(ctx)
 
     if ctx.obj.get("cloud", None) == "aws":
         instance_type = click.prompt("instance type", default="m5n.large")
-        machine_image = click.prompt("machine image", default="ami-0128839b21d19300e")
-        aws.deploy(instance_type, container_image_url, machine_image)
+        provider.deploy(
+            instance_type,
+            container_image_url,
+            machine_image,
+            count,
+            readiness=readiness,
+            poll_interval=poll_interval,
+            poll_backoff=poll_backoff,
+        )
     elif ctx.obj.get("cloud", None) == "gcp":
         machine_type = click.prompt("machine type", default="n2-highmem-80")
         image_project = click.prompt("machine image project", default="cos-cloud")
-        machine_image = click.prompt("machine image", default="cos-89-lts")
+        if machine_image is None:
+            machine_image = click.prompt("machine image", default="cos-89-lts")
         #cpu_platform = click.prompt("cpu platform", default="Intel Skylake")
             #cpu_platform,
-        gcp.deploy(
+        provider.deploy(
             machine_type,
             container_image_url,
             machine_image,
             image_project,
+            env=env,
+            count=count,
+            backend=backend,
         )
     elif ctx.obj.get("cloud", None) == "azure":
         instance_type = click.prompt("instance type", default="Standard_F2s_v2")
-        machine_image = click.prompt(
-            "machine image",
-            default="UbuntuServer",
-            type=click.Choice(["UbuntuServer"]),
+        if machine_image is None:
+            machine_image = click.prompt(
+                "machine image",
+                default="UbuntuServer",
+                type=click.Choice(["UbuntuServer"]),
+            )
+        provider.deploy(
+            instance_type,
+            container_image_url,
+            machine_image,
+            mode=backend,
+            shared_network=shared_network,
+            count=count,
+            use_baked_image=baked_image,
+            env=env,
+            run_flags=run_flags,
+            extra_images=extra_images,
         )
-        azure.deploy(instance_type, container_image_url, machine_image)
 
 
 @cli.command("stop")
+@click.option(
+    "--no-wait",
+    is_flag=True,
+    default=False,
+    help="azure: start the deletions and return, check on them with status.",
+)
 @click.pass_context
-def stop(ctx):
+def stop(ctx, no_wait):
     click.confirm(
         "This action will stop all services. Are you sure you want to proceed?",
         abort=True,
     )
     logger.debug("Stopping container service")
-    if ctx.obj.get("cloud", None) == "aws":
-        aws.stop()
-    elif ctx.obj.get("cloud", None) == "azure":
-        azure.stop()
-    elif ctx.obj.get("cloud", None) == "gcp":
-        gcp.stop()
+    provider = _provider(ctx)
+    if provider is None:
+        return
+    if no_wait and ctx.obj.get("cloud", None) == "azure":
+        provider.stop(no_wait=True)
+    else:
+        provider.stop()
+
+
+@cli.command("status")
+@click.pass_context
+def status(ctx):
+    """show deployments and pending operations."""
+    provider = _provider(ctx)
+    if provider is None:
+        return
+    try:
+        provider.status()
+    except NotImplementedError:
+        click.echo(f"status is not supported for {ctx.obj.get('cloud')}")
+
+
+@cli.command("scale")
+@click.option(
+    "--count",
+    "-n",
+    required=True,
+    type=click.IntRange(min=1),
+    help="number of instances the deployment should run.",
+)
+@click.pass_context
+def scale(ctx, count):
+    """change the number of instances of a running deployment."""
+    provider = _provider(ctx)
+    if provider is None:
+        return
+    try:
+        provider.scale(count)
+    except NotImplementedError:
+        click.echo(f"scale is not supported for {ctx.obj.get('cloud')}")
+
+
+@cli.command("bake")
+@click.option(
+    "--image",
+    "-i",
+    "images",
+    multiple=True,
+    required=True,
+    help="container image to pre-pull, can be repeated.",
+)
+@click.option(
+    "--instance-type",
+    default="Standard_F2s_v2",
+    help="instance type of the temporary vm the image is captured from.",
+)
+@click.pass_context
+def bake(ctx, images, instance_type):
+    """capture a machine image with docker installed and container images pulled."""
+    provider = _provider(ctx)
+    if provider is None:
+        return
+    try:
+        provider.bake(instance_type, images)
+    except NotImplementedError:
+        click.echo(f"bake is not supported for {ctx.obj.get('cloud')}")
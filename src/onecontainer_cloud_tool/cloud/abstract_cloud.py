@@ -20,3 +20,15 @@ class Cloud(metaclass=abc.ABCMeta):
     def stop(self):
         """stop container service and cleanup any config files."""
         raise NotImplementedError
+
+    def status(self):
+        """report the state of deployments, clouds that can't raise NotImplementedError."""
+        raise NotImplementedError
+
+    def scale(self, count):
+        """change the instance count of a deployment in place, clouds that can't raise NotImplementedError."""
+        raise NotImplementedError
+
+    def bake(self, instance_type, images):
+        """capture a machine image with the container images preinstalled, clouds that can't raise NotImplementedError."""
+        raise NotImplementedError
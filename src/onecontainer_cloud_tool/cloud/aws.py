@@ -1,18 +1,122 @@
 # SPDX-License-Identifier: BSD-3-Clause
 # Copyright (c) 2021 Intel Corporation
 
+from concurrent.futures import ThreadPoolExecutor
 import configparser
+import hashlib
+import json
+import math
 import os
+import re
+import time
 from pathlib import Path
-from functools import lru_cache
-from typing import Dict, List
+from typing import Dict, List, Optional
 
-import boto3
+from botocore.exceptions import ClientError
 
+from onecontainer_cloud_tool.cloud import aws_session
 from onecontainer_cloud_tool.cloud.abstract_cloud import Cloud
+from onecontainer_cloud_tool import cloudinit
 from onecontainer_cloud_tool import config
 from onecontainer_cloud_tool import utils
 from onecontainer_cloud_tool.logger import logger
+from onecontainer_cloud_tool.state import LocalState
+from onecontainer_cloud_tool.step_graph import Step, StepGraph
+
+# "ecs" returns once the ECS agent registered the instances with the cluster,
+# "status-ok" waits for both EC2 status checks to pass.
+READINESS_MODES = ("ecs", "status-ok")
+READINESS_MAX_POLL_INTERVAL = 15.0
+READINESS_TIMEOUT = 900
+# deployments and api calls torn down at the same time by stop
+STOP_MAX_WORKERS = 16
+# delete_task_definitions accepts at most 10 arns per call
+TASK_DEFINITION_BATCH = 10
+# errors raised while ENIs detach or the cluster drains, worth retrying
+TEARDOWN_RETRY_CODES = {
+    "DependencyViolation",
+    "ClusterContainsContainerInstancesException",
+    "ClusterContainsTasksException",
+    "ClusterContainsServicesException",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+}
+
+SECURITY_GROUP_EGRESS = [
+    {
+        "FromPort": 0,
+        "IpProtocol": "tcp",
+        "IpRanges": [
+            {
+                "CidrIp": "0.0.0.0/0",
+                "Description": "Allow outgoing traffic to all destinations",
+            },
+        ],
+        "ToPort": 65535,
+    },
+]
+SECURITY_GROUP_INGRESS = [
+    {
+        "IpProtocol": "tcp",
+        "FromPort": 80,
+        "ToPort": 80,
+        "IpRanges": [{"CidrIp": "0.0.0.0/0"}],
+    },
+    {
+        "IpProtocol": "tcp",
+        "FromPort": 443,
+        "ToPort": 443,
+        "IpRanges": [{"CidrIp": "0.0.0.0/0"}],
+    },
+    {
+        "IpProtocol": "tcp",
+        "FromPort": 22,
+        "ToPort": 22,
+        "IpRanges": [{"CidrIp": "0.0.0.0/0"}],
+    },
+]
+# default vpc, subnets and account id per region, revalidated after a day or
+# as soon as aws reports the cached vpc as unknown
+DISCOVERY_TTL = 24 * 60 * 60
+discovery_state = LocalState("aws-discovery")
+# public SSM parameters with the latest ECS-optimized Amazon Linux 2 AMI
+ECS_AMI_PARAMETERS = {
+    "x86_64": "/aws/service/ecs/optimized-ami/amazon-linux-2/recommended/image_id",
+    "arm64": "/aws/service/ecs/optimized-ami/amazon-linux-2/arm64/recommended/image_id",
+}
+AMI_TTL = 24 * 60 * 60
+ami_state = LocalState("aws-ami")
+# security groups are shared by deployments with the same rules, found by the
+# hash of the ruleset and deleted once no network interface uses them anymore
+RULESET_TAG = "occt-ruleset"
+
+
+def ruleset_hash(ingress: List[Dict], egress: List[Dict]) -> str:
+    """content hash identifying a set of security group rules."""
+    rules = json.dumps({"ingress": ingress, "egress": egress}, sort_keys=True)
+    return hashlib.sha256(rules.encode()).hexdigest()[:16]
+
+
+def instance_architecture(instance_type: str) -> str:
+    """cpu architecture of an instance type, Graviton families carry a g suffix."""
+    family = instance_type.split(".")[0]
+    match = re.match(r"^[a-z]+\d+([a-z-]*)$", family)
+    if family == "a1" or (match and "g" in match.group(1)):
+        return "arm64"
+    return "x86_64"
+
+
+def _is_not_found_error(err: Exception) -> bool:
+    return isinstance(err, ClientError) and err.response.get("Error", {}).get(
+        "Code", ""
+    ).endswith("NotFound")
+
+
+def _is_retryable_teardown_error(err: Exception) -> bool:
+    return (
+        isinstance(err, ClientError)
+        and err.response.get("Error", {}).get("Code") in TEARDOWN_RETRY_CODES
+    )
 
 
 class AWS(Cloud):
@@ -33,12 +137,16 @@ class AWS(Cloud):
             All of this is written in an configuration occ_config.ini file for future use.
         """
         key_file_path = Path.home().resolve() / ".ssh"/ f"{config.KEY_FILE}.pem"
+        # credentials or region may have changed, don't reuse the old sessions
+        AWS._reset_clients()
         try:
-            ec2_client = boto3.client(
+            # few attempts, a wrong region or key should fail fast
+            ec2_client = aws_session.get_client(
                 "ec2",
-                aws_access_key_id=access_key,
-                aws_secret_access_key=secret_key,
-                region_name=region,
+                region,
+                access_key=access_key,
+                secret_key=secret_key,
+                max_attempts=2,
             )
             key_pair = ec2_client.create_key_pair(KeyName=config.KEY_FILE)
             logger.debug(f"Writing private key in {config.KEY_FILE}.pem")
@@ -68,57 +176,78 @@ class AWS(Cloud):
             self.ini_conf.write(config_file)
 
     @classmethod
-    @lru_cache(maxsize=10)
     def _get_clients(cls):
-        """login to ec2 and ecs."""
+        """ec2 and ecs clients from the pooled session of the configured account."""
+        return cls._get_client("ec2"), cls._get_client("ecs")
+
+    @classmethod
+    def _get_client(cls, service_name: str):
+        """client of service_name from the pooled session of the configured account."""
         if not hasattr(cls, "ini_conf"):
             logger.debug("ini_conf attribute not found, setting.")
             setattr(cls, "ini_conf", configparser.ConfigParser())
             cls.ini_conf.read(config.CONFIG_FILE)
-        aws_access_key_id = cls.ini_conf["AWS"].get("ACCESS_KEY")
-        aws_secret_access_key = cls.ini_conf["AWS"].get("SECRET_KEY")
-        region_name = cls.ini_conf["AWS"].get("REGION")
-        ec2 = boto3.client(
-            "ec2",
-            aws_access_key_id=aws_access_key_id,
-            aws_secret_access_key=aws_secret_access_key,
-            region_name=region_name,
-        )
-        ecs = boto3.client(
-            "ecs",
-            aws_access_key_id=aws_access_key_id,
-            aws_secret_access_key=aws_secret_access_key,
-            region_name=region_name,
-        )
-        return ec2, ecs
+        settings = aws_session.settings_from_config(cls.ini_conf["AWS"])
+        return aws_session.get_client(service_name, **settings)
+
+    @classmethod
+    def _reset_clients(cls):
+        """forget the cached config and sessions so the next clients use new settings."""
+        if "ini_conf" in vars(cls):
+            delattr(cls, "ini_conf")
+        aws_session.invalidate()
 
     @classmethod
     def _check_config_file(cls):
         if not os.path.isfile(config.CONFIG_FILE):
             raise FileNotFoundError
 
-    def deploy(self, instance_type: str, image: str, ami: str):
-        """deploy container image using the given instance_type and ami"""
+    def deploy(
+        self,
+        instance_type: str,
+        image: str,
+        ami: Optional[str] = None,
+        count: int = 1,
+        readiness: str = "ecs",
+        poll_interval: float = 2.0,
+        poll_backoff: float = 1.5,
+    ):
+        """deploy container image on count instances using the given instance_type and ami,
+        the latest ECS-optimized AMI of the region is used when no ami is given."""
         try:
             AWS._check_config_file()
             self.timestamp = utils.timestamp()
             self.cluster_name = f"onecontainer-cluster-{self.timestamp}"
-            self.security_group_name = f"onecontainer-security-group-{self.timestamp}"
+            self.security_group_name = (
+                f"onecontainer-sg-{ruleset_hash(SECURITY_GROUP_INGRESS, SECURITY_GROUP_EGRESS)}"
+            )
             self.service_name = f"onecontainer-service-{self.timestamp}"
-            self.task_name = f"onecontainer-task-{self.timestamp}"
-            self.vpc_id = self._get_default_vpc()
-            self.security_group_id = self._config_security_group()
+            self.security_group_id = None
             ec2, ecs = AWS._get_clients()
-            ecs.create_cluster(clusterName=self.cluster_name)
-            (self.dns, self.ip_address) = self._create_ec2_instance(ec2, instance_type, ami)
-            self._register_container_task(ecs, image)
-            self._create_service(ecs)
+            graph = StepGraph(
+                self._deploy_steps(
+                    ec2,
+                    ecs,
+                    instance_type,
+                    image,
+                    ami,
+                    count,
+                    readiness,
+                    poll_interval,
+                    poll_backoff,
+                )
+            )
+            try:
+                graph.run()
+            finally:
+                graph.log_critical_path()
             self._write_config()
             logger.info("Success!")
             logger.info("You can access the deployed solution via SSH")
-            logger.info(f"ec2-user@{self.dns}")
-            logger.info("or")
-            logger.info(f"ec2-user@{self.ip_address}")
+            for instance in self.instances:
+                logger.info(f"ec2-user@{instance['dns']}")
+                logger.info("or")
+                logger.info(f"ec2-user@{instance['ip_address']}")
             logger.info(
                 f"Use the private key file generated to authenticate in the ssh connection"
             )
@@ -126,49 +255,219 @@ class AWS(Cloud):
             logger.error("configuration file not found. please run init command first")
         except Exception as err:
             logger.error(f"failed to deploy service:{err}")
+            self._release_failed_deployment()
+
+    def _release_failed_deployment(self):
+        """delete the security group taken by a deploy that wrote no section,
+        unless other deployments use it."""
+        security_group_id = getattr(self, "security_group_id", None)
+        if security_group_id is None:
+            return
+        try:
+            AWS._release_security_group(AWS._get_client("ec2"), security_group_id)
+        except Exception as err:
+            logger.error(f"could not release security group {security_group_id}: {err}")
+
+    def _deploy_steps(
+        self,
+        ec2,
+        ecs,
+        instance_type: str,
+        image: str,
+        ami: Optional[str],
+        count: int,
+        readiness: str,
+        poll_interval: float,
+        poll_backoff: float,
+    ) -> List[Step]:
+        """provisioning steps of a deployment and what each of them waits for."""
+
+        def vpc():
+            self.vpc_id = self._get_default_vpc()
+
+        def security_group():
+            try:
+                self.security_group_id = self._config_security_group()
+            except ClientError as err:
+                if err.response.get("Error", {}).get("Code") != "InvalidVpcID.NotFound":
+                    raise
+                logger.debug(f"cached vpc {self.vpc_id} is gone, rediscovering")
+                self.vpc_id = self._get_default_vpc(refresh=True)
+                self.security_group_id = self._config_security_group()
+
+        def machine_image():
+            self.ami = ami or AWS.resolve_ecs_ami(instance_type)
+
+        def instances():
+            self.instances = self._create_ec2_instances(
+                ec2,
+                ecs,
+                instance_type,
+                self.ami,
+                count,
+                readiness=readiness,
+                poll_interval=poll_interval,
+                poll_backoff=poll_backoff,
+            )
+
+        return [
+            Step("vpc", vpc),
+            Step("machine_image", machine_image),
+            Step("security_group", security_group, requires=["vpc"]),
+            Step("cluster", lambda: ecs.create_cluster(clusterName=self.cluster_name)),
+            Step("task_definition", lambda: self._register_container_task(ecs, image)),
+            Step(
+                "instances",
+                instances,
+                requires=["machine_image", "security_group", "cluster"],
+            ),
+            Step(
+                "service",
+                lambda: self._create_service(ecs, count),
+                requires=["cluster", "task_definition"],
+            ),
+        ]
+
+    @classmethod
+    def resolve_ecs_ami(cls, instance_type: str, architecture: Optional[str] = None) -> str:
+        """latest ECS-optimized Amazon Linux 2 AMI of the configured region.
+
+        Read from the public SSM parameter and cached per region for AMI_TTL seconds.
+        """
+        architecture = architecture or instance_architecture(instance_type)
+        ssm = cls._get_client("ssm")
+        key = f"{cls.ini_conf['AWS'].get('REGION')}:{architecture}"
+        ami = ami_state.get(key, ttl=AMI_TTL)
+        if ami is None:
+            response = ssm.get_parameter(Name=ECS_AMI_PARAMETERS[architecture])
+            ami = response["Parameter"]["Value"]
+            ami_state.set(key, ami)
+        logger.debug(f"Using ECS-optimized AMI {ami} for {architecture}")
+        return ami
 
     def _create_vpc(self, ec2):
-        """create vpc if it doesn't exist, if it does use the vpc_id to get sec group."""
+        """create the default vpc, only called when the region has none."""
         try:
             ec2.create_default_vpc()
             logger.debug("default VPC created.")
-        except Exception:
+        except ClientError as err:
+            # created by a concurrent deploy since we looked
+            if err.response.get("Error", {}).get("Code") != "DefaultVpcAlreadyExists":
+                raise
             logger.debug("default VPC available.")
 
-    def _create_ec2_instance(self, ec2, instance_type: str, ami: str):
-        """launch ec2 instance with an instance type and ami."""
-        logger.debug(f"Launching EC2 instances")
+    def _create_ec2_instances(
+        self,
+        ec2,
+        ecs,
+        instance_type: str,
+        ami: str,
+        count: int = 1,
+        readiness: str = "ecs",
+        poll_interval: float = 2.0,
+        poll_backoff: float = 1.5,
+    ) -> List[Dict]:
+        """launch count ec2 instances with an instance type and ami in a single request."""
+        logger.debug(f"Launching {count} EC2 instances")
         ec2_instance_res = ec2.run_instances(
             ImageId=ami,
-            MinCount=1,
-            MaxCount=1,
+            MinCount=count,
+            MaxCount=count,
             InstanceType=instance_type,
             IamInstanceProfile={"Name": "ecsInstanceRole"},
             SecurityGroupIds=[self.security_group_id],
             KeyName=self.ini_conf["AWS"].get("PRIVATE_KEY_FILE").split(".")[0],
-            UserData="#!/bin/bash \n echo ECS_CLUSTER="
-            + self.cluster_name
-            + " >> /etc/ecs/ecs.config",
+            UserData=cloudinit.user_data_script(
+                f"echo ECS_CLUSTER={self.cluster_name} >> /etc/ecs/ecs.config"
+            ),
         )
-        waiter = ec2.get_waiter("instance_status_ok")
-        for ec2_instance in ec2_instance_res["Instances"]:
-            waiter.wait(InstanceIds=[ec2_instance["InstanceId"]])
-            logger.debug(f'EC2 Instance {ec2_instance["InstanceId"]} created.')
-            ec2_reloaded_res = ec2.describe_instances(
-                InstanceIds=[ec2_instance["InstanceId"]]
-            )
-            ec2_instances_reloaded = ec2_reloaded_res["Reservations"][0]["Instances"]
-            if ec2_instances_reloaded:
-                logger.debug(
-                    f'EC2 Instance DNS: {ec2_instances_reloaded[0]["PublicDnsName"]}'
-                )
-                logger.debug(
-                    f"EC2 Instance public ip: {ec2_instances_reloaded[0]['PublicIpAddress']}"
+        instance_ids = [
+            ec2_instance["InstanceId"] for ec2_instance in ec2_instance_res["Instances"]
+        ]
+        self._wait_until_ready(
+            ec2, ecs, instance_ids, readiness, poll_interval, poll_backoff
+        )
+        logger.debug(f"EC2 Instances {', '.join(instance_ids)} created.")
+        ec2_reloaded_res = ec2.describe_instances(InstanceIds=instance_ids)
+        instances = []
+        for reservation in ec2_reloaded_res["Reservations"]:
+            for ec2_instance in reservation["Instances"]:
+                logger.debug(f'EC2 Instance DNS: {ec2_instance["PublicDnsName"]}')
+                logger.debug(f"EC2 Instance public ip: {ec2_instance['PublicIpAddress']}")
+                instances.append(
+                    {
+                        "instance_id": ec2_instance["InstanceId"],
+                        "dns": ec2_instance["PublicDnsName"],
+                        "ip_address": ec2_instance["PublicIpAddress"],
+                    }
                 )
-                return (
-                    ec2_instances_reloaded[0]["PublicDnsName"],
-                    ec2_instances_reloaded[0]["PublicIpAddress"],
+        return instances
+
+    def _wait_until_ready(
+        self,
+        ec2,
+        ecs,
+        instance_ids: List[str],
+        readiness: str = "ecs",
+        poll_interval: float = 2.0,
+        poll_backoff: float = 1.5,
+    ) -> Dict[str, float]:
+        """block until the instances can take tasks and return the seconds spent per phase.
+
+        Waiters poll the whole fleet with one describe call per attempt.
+        """
+        if readiness not in READINESS_MODES:
+            raise ValueError(f"unknown readiness mode {readiness}")
+        waiter_config = {
+            "Delay": max(1, round(poll_interval)),
+            "MaxAttempts": math.ceil(READINESS_TIMEOUT / max(1, round(poll_interval))),
+        }
+        timings = {}
+        start = time.monotonic()
+        if readiness == "status-ok":
+            ec2.get_waiter("instance_status_ok").wait(
+                InstanceIds=instance_ids, WaiterConfig=waiter_config
+            )
+            timings["instance_status_ok"] = time.monotonic() - start
+        else:
+            ec2.get_waiter("instance_running").wait(
+                InstanceIds=instance_ids, WaiterConfig=waiter_config
+            )
+            timings["instance_running"] = time.monotonic() - start
+            registered = time.monotonic()
+            self._wait_for_container_instances(
+                ecs, len(instance_ids), poll_interval, poll_backoff
+            )
+            timings["ecs_registration"] = time.monotonic() - registered
+        logger.info(
+            "instances ready: "
+            + ", ".join(f"{phase} {seconds:.1f}s" for phase, seconds in timings.items())
+        )
+        return timings
+
+    def _wait_for_container_instances(
+        self, ecs, count: int, poll_interval: float = 2.0, poll_backoff: float = 1.5
+    ):
+        """poll the new cluster until count container instances registered."""
+        deadline = time.monotonic() + READINESS_TIMEOUT
+        delays = utils.backoff_delays(
+            poll_interval, poll_backoff, READINESS_MAX_POLL_INTERVAL, jitter=0.1
+        )
+        paginator = ecs.get_paginator("list_container_instances")
+        while True:
+            # a page holds at most 100 arns
+            registered = sum(
+                len(page["containerInstanceArns"])
+                for page in paginator.paginate(cluster=self.cluster_name, status="ACTIVE")
+            )
+            if registered >= count:
+                return
+            logger.debug(f"{registered}/{count} container instances registered")
+            if time.monotonic() >= deadline:
+                raise TimeoutError(
+                    f"container instances did not register with {self.cluster_name}"
                 )
+            time.sleep(next(delays))
 
     def _register_container_task(
         self,
@@ -180,10 +479,13 @@ class AWS(Cloud):
     ):
         """Allows configuration of the container and the specification of the image,
         portMappings are not used at the moment but are commented to show how they would be set.
-        Memory and CPU  set by default."""
-        ecs.register_task_definition(
-            networkMode="host",
-            containerDefinitions=[
+        Memory and CPU  set by default.
+
+        Task definitions are content addressed: the family is named after a hash
+        of the definition and its ACTIVE revision is reused when it exists."""
+        task_definition = {
+            "networkMode": "host",
+            "containerDefinitions": [
                 {
                     "name": f"task_name",
                     "image": image,
@@ -199,19 +501,36 @@ class AWS(Cloud):
                     "cpu": cpu,
                 }
             ],
+        }
+        self.task_hash = hashlib.sha256(
+            json.dumps(task_definition, sort_keys=True).encode()
+        ).hexdigest()[:16]
+        self.task_name = f"onecontainer-task-{self.task_hash}"
+        try:
+            response = ecs.describe_task_definition(taskDefinition=self.task_name)
+            if response["taskDefinition"]["status"] == "ACTIVE":
+                logger.debug(f"Reusing task definition {self.task_name}")
+                return
+        except ClientError:
+            logger.debug(f"Task definition {self.task_name} not registered yet")
+        ecs.register_task_definition(
             family=self.task_name,
+            tags=[{"key": "occt-task-hash", "value": self.task_hash}],
+            **task_definition,
         )
         logger.debug("Task definition created")
 
-    def _create_service(self, ecs):
-        """sets cluster, taskDefinition and service name and then creates the ECS service."""
+    def _create_service(self, ecs, count: int = 1):
+        """sets cluster, taskDefinition and service name and then creates the ECS service,
+        one task per instance."""
         ecs.create_service(
             cluster=self.cluster_name,
             serviceName=self.service_name,
             taskDefinition=self.task_name,
             launchType="EC2",
-            desiredCount=1,
-            clientToken=f"{self.task_name}",
+            desiredCount=count,
+            clientToken=self.service_name,
+            placementConstraints=[{"type": "distinctInstance"}],
             deploymentConfiguration={
                 "maximumPercent": 200,
                 "minimumHealthyPercent": 50,
@@ -226,9 +545,11 @@ class AWS(Cloud):
             "default_vpc_id": self.vpc_id,
             "security_group_id": self.security_group_id,
             "task_name": self.task_name,
+            "task_hash": self.task_hash,
             "service_name": self.service_name,
-            "ssh_ip": f"ec2-user@{self.ip_address}",
-            "ssh_dns": f"ec2-user@{self.dns}"
+            "instance_ids": ",".join(instance["instance_id"] for instance in self.instances),
+            "ssh_ip": ",".join(f"ec2-user@{instance['ip_address']}" for instance in self.instances),
+            "ssh_dns": ",".join(f"ec2-user@{instance['dns']}" for instance in self.instances),
         }
         with open(config.CONFIG_FILE, "w") as config_file:
             self.ini_conf.write(config_file)
@@ -237,78 +558,230 @@ class AWS(Cloud):
         )
 
     def stop(self):
-        """stop all running services, delete config file and keys."""
+        """stop all running services, delete config file and keys.
+
+        Teardown failures of single deployments are reported once the
+        remaining resources, keys and configuration are removed.
+        """
+        errors = []
         try:
             AWS._check_config_file()
-            instance_ids = []
-            cluster_sgs_info = []
+            sections = {}
             for each_section in [
                 section_name
                 for section_name in self.ini_conf.sections()
                 if "AWS-service" in section_name
             ]:
-                section = dict(self.ini_conf.items(each_section))
+                sections[each_section] = dict(self.ini_conf.items(each_section))
                 self.ini_conf.remove_section(each_section)
                 logger.debug(f"Stopping service {each_section}")
 
-                cluster_sgs_info.append(
-                    (section["cluster_name"], section["security_group_id"])
-                )
-
-                instance_ids += AWS._delete_service(
-                    section["cluster_name"],
-                    section["service_name"],
-                    section["task_name"],
-                )
-
-            AWS._remove_key_pair(
-                self.ini_conf["AWS"].get("PRIVATE_KEY_FILE").split(".")[0]
-            )
-            AWS._terminate_cluster_instances(instance_ids, cluster_sgs_info)
-            os.remove(self.ini_conf["AWS"].get("PRIVATE_KEY_FILE_PATH"))
-            self.ini_conf.remove_section("AWS")
-            if not utils.remove_config_if_empty(self.ini_conf, config):
+            cluster_sgs_info = [
+                (section["cluster_name"], section["security_group_id"])
+                for section in sections.values()
+            ]
+            instance_ids = []
+            # clusters whose teardown failed, their sections are kept to run stop again
+            failed_clusters = set()
+            # one pool for every stage of the teardown, stages only submit to it
+            # from this thread so no worker blocks on work queued behind it
+            with ThreadPoolExecutor(max_workers=STOP_MAX_WORKERS) as pool:
+                futures = [
+                    pool.submit(
+                        AWS._delete_service,
+                        section["cluster_name"],
+                        section["service_name"],
+                        section["task_name"],
+                        deregister_tasks=False,
+                    )
+                    for section in sections.values()
+                ]
+                for section, future in zip(sections.values(), futures):
+                    try:
+                        section_instance_ids = future.result()
+                    except Exception as err:
+                        errors.append(err)
+                        failed_clusters.add(section["cluster_name"])
+                        section_instance_ids = []
+                    # instances that never registered with the cluster are terminated too
+                    recorded_ids = section.get("instance_ids", "").split(",")
+                    for instance_id in section_instance_ids + recorded_ids:
+                        if instance_id and instance_id not in instance_ids:
+                            instance_ids.append(instance_id)
+                # content addressed task definitions are kept for reuse
+                for section in sections.values():
+                    if "task_hash" not in section:
+                        try:
+                            AWS._deregister_tasks(
+                                AWS._get_client("ecs"), section["task_name"], pool=pool
+                            )
+                        except Exception as err:
+                            errors.append(err)
+                            failed_clusters.add(section["cluster_name"])
+                for clusters, err in AWS._terminate_cluster_instances(
+                    instance_ids, cluster_sgs_info, pool=pool
+                ):
+                    errors.append(err)
+                    failed_clusters.update(clusters)
+
+            if errors:
+                # keep the session, its key and the failed deployments for another stop
+                for section_name, section in sections.items():
+                    if section["cluster_name"] in failed_clusters:
+                        self.ini_conf[section_name] = section
                 with open(config.CONFIG_FILE, "w") as config_file:
                     self.ini_conf.write(config_file)
+            else:
+                AWS._remove_key_pair(
+                    self.ini_conf["AWS"].get("PRIVATE_KEY_FILE").split(".")[0]
+                )
+                os.remove(self.ini_conf["AWS"].get("PRIVATE_KEY_FILE_PATH"))
+                self.ini_conf.remove_section("AWS")
+                if not utils.remove_config_if_empty(self.ini_conf, config):
+                    with open(config.CONFIG_FILE, "w") as config_file:
+                        self.ini_conf.write(config_file)
 
-            logger.debug(
-                f"{config.KEY_FILE} key file and configuration removed"
-            )
+                logger.debug(
+                    f"{config.KEY_FILE} key file and configuration removed"
+                )
         except FileNotFoundError:
             logger.error("configuration file not found. please run init command first")
+        for err in errors:
+            logger.error(f"failed to stop service: {err}")
+        if errors:
+            logger.error("the failed deployments are kept in the configuration, run stop again")
 
-    def _get_default_vpc(self) -> str:
-        try:
-            ec2, _ = AWS._get_clients()
-            self._create_vpc(ec2) 
-        except:
-            logger.debug("Using default VPC")
-            
-        response = ec2.describe_vpcs(
+    def _get_default_vpc(self, refresh: bool = False) -> str:
+        """default vpc id of the region, from the local discovery cache when fresh."""
+        return self._discover_network(refresh)["vpc_id"]
+
+    @classmethod
+    def _discovery_key(cls) -> str:
+        """region and a hash of the credentials, the state file holds no access key."""
+        section = cls.ini_conf["AWS"]
+        identity = section.get("ACCESS_KEY") or section.get("PROFILE") or "default"
+        digest = hashlib.sha256(identity.encode()).hexdigest()[:16]
+        return f"{section.get('REGION')}:{digest}"
+
+    def _discover_network(self, refresh: bool = False) -> Dict:
+        """default vpc, its default subnets and the account id of the region.
+
+        Resolved once and kept in local state for DISCOVERY_TTL seconds.
+        """
+        ec2 = AWS._get_client("ec2")
+        key = AWS._discovery_key()
+        if not refresh:
+            cached = discovery_state.get(key, ttl=DISCOVERY_TTL)
+            if cached:
+                logger.debug(f"Using cached default VPC {cached['vpc_id']}")
+                return cached
+        vpcs = ec2.describe_vpcs(Filters=[{"Name": "isDefault", "Values": ["true"]}])["Vpcs"]
+        if not vpcs:
+            self._create_vpc(ec2)
+            vpcs = ec2.describe_vpcs(
                 Filters=[{"Name": "isDefault", "Values": ["true"]}]
-            )
-        return response["Vpcs"][0]["VpcId"]
+            )["Vpcs"]
+            if not vpcs:
+                raise RuntimeError("the region has no default VPC and none could be created")
+        vpc_id = vpcs[0]["VpcId"]
+        subnets = ec2.describe_subnets(
+            Filters=[
+                {"Name": "vpc-id", "Values": [vpc_id]},
+                {"Name": "default-for-az", "Values": ["true"]},
+            ]
+        )["Subnets"]
+        account_id = AWS._get_client("sts").get_caller_identity()["Account"]
+        discovered = {
+            "vpc_id": vpc_id,
+            "subnet_ids": [subnet["SubnetId"] for subnet in subnets],
+            "account_id": account_id,
+        }
+        discovery_state.set(key, discovered)
+        logger.debug(f"Using default VPC {vpc_id} of account {account_id}")
+        return discovered
 
 
     @classmethod
-    def _terminate_cluster_instances(cls, instance_ids: List, clusters_info: Dict):
+    def _terminate_cluster_instances(
+        cls, instance_ids: List, clusters_info: List, pool: ThreadPoolExecutor = None
+    ) -> List:
+        """terminate the instances, then delete the clusters and release their
+        security groups on pool.
+
+        Returns the errors of the teardown, each with the names of the clusters
+        it leaves behind. Recorded instances that no longer exist are skipped.
+        """
         logger.debug(f"Terminating cluster instances")
         ec2, ecs = AWS._get_clients()
-        if instance_ids:
-            waiter = ec2.get_waiter("instance_terminated")
-            ec2.terminate_instances(
-                DryRun=False,
-                InstanceIds=instance_ids,
-            )
-            waiter.wait(InstanceIds=instance_ids)
-        # deletion of now empty ECS clusters
-        for (cluster_name, security_group_id) in clusters_info:
+        all_clusters = [cluster_name for (cluster_name, _) in clusters_info]
+        try:
+            if instance_ids:
+                instance_ids = AWS._existing_instances(ec2, instance_ids)
+            if instance_ids:
+                waiter = ec2.get_waiter("instance_terminated")
+                ec2.terminate_instances(
+                    DryRun=False,
+                    InstanceIds=instance_ids,
+                )
+                waiter.wait(InstanceIds=instance_ids)
+        except Exception as err:
+            # clusters still holding instances can't be deleted
+            return [(all_clusters, err)]
+        # deletion of now empty ECS clusters, retried while instances deregister
+        # and ENIs detach from the security groups
+        def delete_cluster(cluster_name):
             logger.debug(f"Removing cluster {cluster_name}")
-            ecs.delete_cluster(cluster=cluster_name)
-            logger.debug(f"Removing security group {security_group_id}")
-            ec2.delete_security_group(
-                GroupId=security_group_id,
+            utils.retry(
+                lambda: ecs.delete_cluster(cluster=cluster_name),
+                _is_retryable_teardown_error,
+            )
+
+        if pool is None:
+            with ThreadPoolExecutor(max_workers=STOP_MAX_WORKERS) as pool:
+                return cls._terminate_cluster_instances([], clusters_info, pool)
+        futures = [
+            (pool.submit(delete_cluster, cluster_name), [cluster_name])
+            for cluster_name in all_clusters
+        ]
+        security_group_ids = dict.fromkeys(sg for (_, sg) in clusters_info)
+        futures += [
+            (
+                pool.submit(AWS._release_security_group, ec2, security_group_id, instance_ids),
+                [name for (name, sg) in clusters_info if sg == security_group_id],
+            )
+            for security_group_id in security_group_ids
+        ]
+        errors = []
+        for future, clusters in futures:
+            try:
+                future.result()
+            except Exception as err:
+                errors.append((clusters, err))
+        return errors
+
+    @staticmethod
+    def _existing_instances(ec2, instance_ids: List) -> List:
+        """the instance_ids not yet terminated. A filter, unlike InstanceIds, doesn't
+        fail the whole call for ids aws already purged."""
+        existing = set()
+        paginator = ec2.get_paginator("describe_instances")
+        # a filter takes at most 200 values
+        for start in range(0, len(instance_ids), 200):
+            pages = paginator.paginate(
+                Filters=[
+                    {"Name": "instance-id", "Values": instance_ids[start : start + 200]},
+                    {
+                        "Name": "instance-state-name",
+                        "Values": ["pending", "running", "stopping", "stopped", "shutting-down"],
+                    },
+                ]
             )
+            for page in pages:
+                for reservation in page["Reservations"]:
+                    existing.update(
+                        instance["InstanceId"] for instance in reservation["Instances"]
+                    )
+        return [instance_id for instance_id in instance_ids if instance_id in existing]
 
     @classmethod
     def _remove_key_pair(cls, key_name: str):
@@ -321,7 +794,11 @@ class AWS(Cloud):
 
     @classmethod
     def _delete_service(
-        cls, cluster_name: str, service_name: str, task_name: str
+        cls,
+        cluster_name: str,
+        service_name: str,
+        task_name: str,
+        deregister_tasks: bool = True,
     ) -> List:
         """delete ecs services and return ec2 instance ids."""
         _, ecs = AWS._get_clients()
@@ -333,27 +810,56 @@ class AWS(Cloud):
             logger.debug(f"Stopping cluster service {service_name}")
         except:
             logger.debug("Service not found/not active")
-        cls._deregister_tasks(ecs, task_name)
+        if deregister_tasks:
+            cls._deregister_tasks(ecs, task_name)
         instance_ids = cls._list_ec2_instances(ecs, cluster_name)
         return instance_ids
 
     @staticmethod
-    def _deregister_tasks(ecs, task_name: str):
-        """Deregister all task definitions for ECS cluster"""
-        response = ecs.list_task_definitions(familyPrefix=task_name, status="ACTIVE")
-        for task_definition in response["taskDefinitionArns"]:
-            ecs.deregister_task_definition(taskDefinition=task_definition)
+    def _deregister_tasks(ecs, task_name: str, pool: ThreadPoolExecutor = None):
+        """Deregister all task definitions for ECS cluster, deleting them in batches
+        where the api supports it."""
+        paginator = ecs.get_paginator("list_task_definitions")
+        task_definitions = [
+            task_definition
+            for page in paginator.paginate(familyPrefix=task_name, status="ACTIVE")
+            for task_definition in page["taskDefinitionArns"]
+        ]
+        if not task_definitions:
+            return
+        if pool is None:
+            with ThreadPoolExecutor(max_workers=STOP_MAX_WORKERS) as pool:
+                return AWS._deregister_tasks(ecs, task_name, pool)
+        list(
+            pool.map(
+                lambda task_definition: ecs.deregister_task_definition(
+                    taskDefinition=task_definition
+                ),
+                task_definitions,
+            )
+        )
+        if hasattr(ecs, "delete_task_definitions"):
+            for start in range(0, len(task_definitions), TASK_DEFINITION_BATCH):
+                ecs.delete_task_definitions(
+                    taskDefinitions=task_definitions[start : start + TASK_DEFINITION_BATCH]
+                )
         logger.debug(f"Deregistering cluster task {task_name}")
 
     @staticmethod
     def _list_ec2_instances(ecs, cluster_name: str) -> List:
-        """list all EC2 instances within ECS cluster."""
-        response = ecs.list_container_instances(cluster=cluster_name)
+        """list all EC2 instances within ECS cluster.
+
+        Pages of container instance arns match the 100 arns
+        describe_container_instances accepts per call.
+        """
+        paginator = ecs.get_paginator("list_container_instances")
         instance_ids = []
-        if response["containerInstanceArns"]:
+        for page in paginator.paginate(cluster=cluster_name):
+            if not page["containerInstanceArns"]:
+                continue
             container_instance_resp = ecs.describe_container_instances(
                 cluster=cluster_name,
-                containerInstances=response["containerInstanceArns"],
+                containerInstances=page["containerInstanceArns"],
             )
             for ec2_instance in container_instance_resp["containerInstances"]:
                 instance_id = ec2_instance["ec2InstanceId"]
@@ -361,8 +867,35 @@ class AWS(Cloud):
         return instance_ids
 
     def _config_security_group(self) -> str:
-        """set egress and ingress rules and configure security group."""
+        """reuse the security group of this ruleset in the vpc, or create and
+        configure it."""
         ec2, _ = AWS._get_clients()
+        ruleset = ruleset_hash(SECURITY_GROUP_INGRESS, SECURITY_GROUP_EGRESS)
+        group = self._find_security_group(ec2, ruleset)
+        if group is None:
+            try:
+                return self._create_security_group(ec2, ruleset)
+            except ClientError as err:
+                if err.response.get("Error", {}).get("Code") != "InvalidGroup.Duplicate":
+                    raise
+                # created by a concurrent deploy since we looked
+                group = self._find_security_group(ec2, ruleset)
+        security_group_id = group["GroupId"]
+        logger.debug(f"reusing security group {security_group_id}.")
+        return security_group_id
+
+    def _find_security_group(self, ec2, ruleset: str):
+        response = ec2.describe_security_groups(
+            Filters=[
+                {"Name": "vpc-id", "Values": [self.vpc_id]},
+                {"Name": f"tag:{RULESET_TAG}", "Values": [ruleset]},
+            ]
+        )
+        groups = response["SecurityGroups"]
+        return groups[0] if groups else None
+
+    def _create_security_group(self, ec2, ruleset: str) -> str:
+        """set egress and ingress rules and configure security group."""
         response = ec2.create_security_group(
             Description="Security Group to allow EC2 instance to register into cluster",
             GroupName=self.security_group_name,
@@ -372,6 +905,7 @@ class AWS(Cloud):
                     "ResourceType": "security-group",
                     "Tags": [
                         {"Key": "sg-app-use", "Value": "one-container-cloud-tool"},
+                        {"Key": RULESET_TAG, "Value": ruleset},
                     ],
                 },
             ],
@@ -379,44 +913,43 @@ class AWS(Cloud):
         security_group_id = response["GroupId"]
         ec2.authorize_security_group_egress(
             GroupId=security_group_id,
-            IpPermissions=[
-                {
-                    "FromPort": 0,
-                    "IpProtocol": "tcp",
-                    "IpRanges": [
-                        {
-                            "CidrIp": "0.0.0.0/0",
-                            "Description": "Allow outgoing traffic to all destinations",
-                        },
-                    ],
-                    "ToPort": 65535,
-                },
-            ],
+            IpPermissions=SECURITY_GROUP_EGRESS,
         )
-        data = ec2.authorize_security_group_ingress(
+        ec2.authorize_security_group_ingress(
             GroupId=security_group_id,
-            IpPermissions=[
-                {
-                    "IpProtocol": "tcp",
-                    "FromPort": 80,
-                    "ToPort": 80,
-                    "IpRanges": [{"CidrIp": "0.0.0.0/0"}],
-                },
-                {
-                    "IpProtocol": "tcp",
-                    "FromPort": 443,
-                    "ToPort": 443,
-                    "IpRanges": [{"CidrIp": "0.0.0.0/0"}],
-                },
-                {
-                    "IpProtocol": "tcp",
-                    "FromPort": 22,
-                    "ToPort": 22,
-                    "IpRanges": [{"CidrIp": "0.0.0.0/0"}],
-                },
-            ],
-
+            IpPermissions=SECURITY_GROUP_INGRESS,
         )
         logger.debug("configured security group for instance.")
         return security_group_id
 
+    @staticmethod
+    def _security_group_in_use(ec2, security_group_id: str, ignore_instances=()) -> bool:
+        """whether a network interface uses the security group. Interfaces of
+        ignore_instances, terminated but not yet detached, don't count."""
+        paginator = ec2.get_paginator("describe_network_interfaces")
+        for page in paginator.paginate(
+            Filters=[{"Name": "group-id", "Values": [security_group_id]}]
+        ):
+            for interface in page["NetworkInterfaces"]:
+                if interface.get("Attachment", {}).get("InstanceId") not in ignore_instances:
+                    return True
+        return False
+
+    @staticmethod
+    def _release_security_group(ec2, security_group_id: str, ignore_instances=()) -> bool:
+        """delete the security group unless another deployment's instances use it,
+        and return whether it is gone. Deletion is retried while ENIs detach."""
+        if AWS._security_group_in_use(ec2, security_group_id, ignore_instances):
+            logger.debug(f"Keeping security group {security_group_id}, still in use")
+            return False
+        logger.debug(f"Removing security group {security_group_id}")
+        try:
+            utils.retry(
+                lambda: ec2.delete_security_group(GroupId=security_group_id),
+                _is_retryable_teardown_error,
+            )
+        except ClientError as err:
+            if not _is_not_found_error(err):
+                raise
+            logger.debug(f"security group {security_group_id} already deleted")
+        return True
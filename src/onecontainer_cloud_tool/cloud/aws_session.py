@@ -0,0 +1,123 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2021 Intel Corporation
+
+"""pooled boto3 sessions and tuned clients shared by all aws operations.
+
+boto3 sessions are not thread safe, clients are. A session is built once per
+region, profile and credentials under a lock, and its clients are handed out
+to the threads of deploy and stop.
+"""
+import threading
+from typing import Dict, Optional
+
+import boto3
+from botocore.config import Config
+
+from onecontainer_cloud_tool.logger import logger
+
+# defaults for the optional client settings of the [AWS] config section, values
+# read from the section are converted to the type of their default
+CLIENT_SETTINGS = {
+    "MAX_POOL_CONNECTIONS": 32,
+    "CONNECT_TIMEOUT": 5.0,
+    "READ_TIMEOUT": 60.0,
+    "MAX_ATTEMPTS": 5,
+}
+
+_lock = threading.Lock()
+_sessions: Dict[tuple, boto3.session.Session] = {}
+_clients: Dict[tuple, object] = {}
+_keepalive_warned = False
+
+
+def client_config(
+    max_pool_connections: int = CLIENT_SETTINGS["MAX_POOL_CONNECTIONS"],
+    connect_timeout: float = CLIENT_SETTINGS["CONNECT_TIMEOUT"],
+    read_timeout: float = CLIENT_SETTINGS["READ_TIMEOUT"],
+    max_attempts: int = CLIENT_SETTINGS["MAX_ATTEMPTS"],
+) -> Config:
+    """botocore config with a connection pool sized for concurrent calls and
+    adaptive retries that back off when the api throttles."""
+    settings = {
+        "max_pool_connections": max_pool_connections,
+        "connect_timeout": connect_timeout,
+        "read_timeout": read_timeout,
+        "retries": {"mode": "adaptive", "max_attempts": max_attempts},
+    }
+    try:
+        return Config(tcp_keepalive=True, **settings)
+    except TypeError:
+        # botocore < 1.27 has no tcp_keepalive option
+        global _keepalive_warned
+        if not _keepalive_warned:
+            _keepalive_warned = True
+            logger.warning(
+                "botocore < 1.27 can't enable tcp keepalive, idle connections of long "
+                "waits may be dropped; upgrade boto3 to use it"
+            )
+        return Config(**settings)
+
+
+def get_session(
+    region: str,
+    profile: Optional[str] = None,
+    access_key: Optional[str] = None,
+    secret_key: Optional[str] = None,
+) -> boto3.session.Session:
+    """cached session for the region, profile and credentials."""
+    key = (region, profile, access_key, secret_key)
+    with _lock:
+        session = _sessions.get(key)
+        if session is None:
+            logger.debug(f"creating aws session for region {region}")
+            session = boto3.session.Session(
+                aws_access_key_id=access_key,
+                aws_secret_access_key=secret_key,
+                region_name=region,
+                profile_name=profile,
+            )
+            _sessions[key] = session
+        return session
+
+
+def get_client(
+    service_name: str,
+    region: str,
+    profile: Optional[str] = None,
+    access_key: Optional[str] = None,
+    secret_key: Optional[str] = None,
+    **settings,
+):
+    """cached client of service_name built from the shared session."""
+    key = (service_name, region, profile, access_key, secret_key, tuple(sorted(settings.items())))
+    with _lock:
+        client = _clients.get(key)
+    if client is not None:
+        return client
+    session = get_session(region, profile, access_key, secret_key)
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = session.client(service_name, config=client_config(**settings))
+            _clients[key] = client
+        return client
+
+
+def settings_from_config(section) -> dict:
+    """session and client keyword arguments from the [AWS] config section."""
+    settings = {
+        "region": section.get("REGION"),
+        "profile": section.get("PROFILE") or None,
+        "access_key": section.get("ACCESS_KEY") or None,
+        "secret_key": section.get("SECRET_KEY") or None,
+    }
+    for name, default in CLIENT_SETTINGS.items():
+        settings[name.lower()] = type(default)(section.get(name, default))
+    return settings
+
+
+def invalidate():
+    """drop every cached session and client, e.g. after credentials or region change."""
+    with _lock:
+        _sessions.clear()
+        _clients.clear()
@@ -0,0 +1,85 @@
+"""azure credentials resolved once at init and reused across commands.
+
+DefaultAzureCredential walks its whole chain, spawning the az cli on the way,
+every time it is built. init records which credential of the chain succeeded,
+later commands build only that one and serve access tokens from a file cache
+until they expire.
+"""
+import threading
+import time
+from typing import Optional
+
+import azure.identity
+from azure.core.credentials import AccessToken
+from azure.identity import DefaultAzureCredential
+
+from onecontainer_cloud_tool.logger import logger
+from onecontainer_cloud_tool.state import LocalState
+
+DEFAULT_CREDENTIAL_OPTIONS = {
+    "exclude_interactive_browser_credential": False,
+    "exclude_managed_identity_credential": True,
+    "exclude_shared_token_cache_credential": True,
+}
+# tokens are refreshed this many seconds before they expire
+EXPIRY_MARGIN = 300
+
+token_state = LocalState("azure-tokens")
+
+
+class CachedTokenCredential:
+    """token credential backed by a persistent, file based access token cache.
+
+    The underlying credential is only built, and the credential chain only
+    walked, when the cache has no valid token for the requested scopes.
+    """
+
+    def __init__(self, credential_type: Optional[str] = None):
+        self.credential_type = credential_type
+        self._credential = None
+        self._lock = threading.Lock()
+
+    def _get_credential(self):
+        if self._credential is None:
+            if self.credential_type and hasattr(azure.identity, self.credential_type):
+                logger.debug(f"using stored azure credential {self.credential_type}")
+                self._credential = getattr(azure.identity, self.credential_type)()
+            else:
+                self._credential = DefaultAzureCredential(**DEFAULT_CREDENTIAL_OPTIONS)
+        return self._credential
+
+    @property
+    def successful_credential_type(self) -> Optional[str]:
+        """class name of the credential that produced the last token."""
+        credential = self._get_credential()
+        successful = getattr(credential, "_successful_credential", None)
+        if successful is not None:
+            return type(successful).__name__
+        if isinstance(credential, DefaultAzureCredential):
+            return None
+        return type(credential).__name__
+
+    def get_token(self, *scopes, **kwargs) -> AccessToken:
+        key = " ".join(sorted(scopes))
+        with self._lock:
+            cached = token_state.get(key)
+            if cached and cached["expires_on"] - EXPIRY_MARGIN > time.time():
+                return AccessToken(cached["token"], cached["expires_on"])
+            token = self._get_credential().get_token(*scopes, **kwargs)
+            token_state.set(key, {"token": token.token, "expires_on": token.expires_on})
+            return token
+
+    def close(self):
+        if self._credential is not None and hasattr(self._credential, "close"):
+            self._credential.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def clear_token_cache():
+    """forget all cached access tokens, e.g. when logging in again at init."""
+    token_state.clear()
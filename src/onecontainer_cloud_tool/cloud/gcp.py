@@ -1,15 +1,108 @@
 import configparser
+import hashlib
+import json
 import sys
+import threading
 import time
 from pathlib import Path
 
+import click
+import google_auth_httplib2
 import googleapiclient.discovery
+import httplib2
+from googleapiclient.errors import HttpError
 from google.oauth2 import service_account
 from progress.spinner import MoonSpinner
 
-from onecontainer_cloud_tool import config, utils
+try:
+    from googleapiclient.version import __version__ as API_CLIENT_VERSION
+except ImportError:  # google-api-python-client < 2.0
+    from googleapiclient import __version__ as API_CLIENT_VERSION
+
+from onecontainer_cloud_tool import cloudinit, config, utils
 from onecontainer_cloud_tool.cloud.abstract_cloud import Cloud
 from onecontainer_cloud_tool.logger import logger
+from onecontainer_cloud_tool.state import LocalState
+from onecontainer_cloud_tool.step_graph import Step, StepGraph
+
+# seconds an operation wait may take in total
+OPERATION_TIMEOUT = 900
+# http statuses of zoneOperations().wait that are retried after a backoff
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+# label holding the timestamp of the deployment an instance belongs to
+DEPLOYMENT_LABEL = "occt-deployment"
+# independent requests sent in one batch http round trip
+BATCH_SIZE = 100
+# operation waits block on the server for up to two minutes, longer than the
+# default http timeout of the api client
+HTTP_TIMEOUT = 150
+DEPLOYMENT_BACKENDS = ("vm", "instance-group")
+# autohealing of instance groups: a tcp check of the ssh port, allowed in by a
+# firewall rule for the google health checker ranges
+HEALTH_CHECK = "occt-health-check"
+HEALTH_CHECK_PORT = 22
+HEALTH_CHECK_FIREWALL = "occt-allow-health-check"
+HEALTH_CHECK_RANGES = ["35.191.0.0/16", "130.211.0.0/22"]
+AUTOHEALING_DELAY = 300
+# name of the single instance deployed before replicas were supported
+LEGACY_INSTANCE = "occt-vm-instance"
+# the compute discovery document changes with the client library, which keys it
+DISCOVERY_VERSION = f"compute/v1/{API_CLIENT_VERSION}"
+discovery_state = LocalState("gcp-discovery")
+
+# parsed discovery document, credentials and clients by service account key, per process
+_lock = threading.Lock()
+_document = None
+_clients = {}
+
+
+def _discovery_document(credentials):
+    """compute v1 discovery document from the state directory, built and stored
+    there the first time a client library version is used."""
+    global _document
+    if _document is None:
+        document = discovery_state.get(DISCOVERY_VERSION)
+        if document is None:
+            logger.debug(f"caching discovery document {DISCOVERY_VERSION}")
+            document = googleapiclient.discovery.build(
+                "compute", "v1", credentials=credentials
+            )._rootDesc
+            discovery_state.clear()
+            discovery_state.set(DISCOVERY_VERSION, document)
+        _document = document
+    return _document
+
+
+def authorized_http(credentials):
+    """http connection authorized with credentials. httplib2 connections aren't
+    thread safe, requests executed concurrently each need their own."""
+    return google_auth_httplib2.AuthorizedHttp(
+        credentials, http=httplib2.Http(timeout=HTTP_TIMEOUT)
+    )
+
+
+def _bulk_insert_unsupported(error):
+    """whether bulkInsert failed because the client or the api lacks it."""
+    if isinstance(error, AttributeError):
+        return True
+    status = error.resp.status
+    return status == 404 or (status == 400 and "not supported" in str(error).lower())
+
+
+def get_compute_client(service_account_key):
+    """compute client and credentials of the service account key, built once per process.
+
+    The credentials refresh their access token themselves when it expires.
+    """
+    key = str(service_account_key)
+    with _lock:
+        if key not in _clients:
+            credentials = service_account.Credentials.from_service_account_file(key)
+            client = googleapiclient.discovery.build_from_document(
+                _discovery_document(credentials), http=authorized_http(credentials)
+            )
+            _clients[key] = (client, credentials)
+        return _clients[key]
 
 
 class GCP(Cloud):
@@ -17,8 +110,6 @@ class GCP(Cloud):
 
     def __init__(self):
         # self.project_id = "ssp-data-centric-10491814"
-        # Default instance name
-        self.instance_name = "occt-vm-instance"
         self.ini_conf = configparser.ConfigParser()
         try:
             self.ini_conf.read(config.CONFIG_FILE)
@@ -50,12 +141,7 @@ class GCP(Cloud):
             logger.error(f"no key found: {ke}")
             logger.error(f"exiting...")
             sys.exit(1)
-        self.credentials = service_account.Credentials.from_service_account_file(
-            self.service_account_key
-        )
-        self.compute_client = googleapiclient.discovery.build(
-            "compute", "v1", credentials=self.credentials
-        )
+        self.compute_client, self.credentials = get_compute_client(self.service_account_key)
 
     def initialize(
         self,
@@ -75,7 +161,17 @@ class GCP(Cloud):
         container_image_url: str = "sysstacks/dlrs-tensorflow2-ubuntu",
         machine_image: str = "cos-stable",
         image_project: str = "cos-cloud",
+        env=(),
+        count: int = 1,
+        backend: str = "vm",
     ):
+        """deploy count replicas of the container image.
+
+        backend "vm" creates the vms directly, "instance-group" creates them
+        through a zonal managed instance group from a reusable instance template.
+        """
+        if backend not in DEPLOYMENT_BACKENDS:
+            raise ValueError(f"unknown gcp deployment backend {backend}")
         self.timestamp = utils.timestamp()
         self.machine_image = machine_image
         self.image_project = image_project
@@ -86,18 +182,24 @@ class GCP(Cloud):
         self.username = "occt-user"
         self._get_compute_client()
         self.container_image_url = container_image_url
+        self.env = tuple(env)
         self.public_ssh_key = utils.SSHkeys().public_key
-        logger.debug("provisioning virtual machine.")
-        operation = self.__create_instance()
-        self.__wait_for_operation(operation["name"])
-        instance_info = (
-            self.compute_client.instances()
-            .get(project=self.project_id, zone=self.zone, instance=self.instance_name)
-            .execute()
-        )
-        self.ip_of_instance = instance_info["networkInterfaces"][0]["accessConfigs"][0][
-            "natIP"
-        ]
+        self.deployment_name = f"occt-vm-{self.timestamp}"
+        self.instance_group = None
+        if backend == "instance-group":
+            self.instance_group = f"occt-group-{self.timestamp}"
+            logger.debug(f"provisioning instance group with {count} virtual machines.")
+            with MoonSpinner("Waiting for operation to complete...") as bar:
+                self._create_instance_group(count, progress=lambda _: bar.next())
+            self.instance_names = self._group_instance_names()
+        else:
+            self.instance_names = [f"{self.deployment_name}-{index}" for index in range(count)]
+            logger.debug(f"provisioning {count} virtual machines.")
+            operations = self._create_instances()
+            with MoonSpinner("Waiting for operation to complete...") as bar:
+                self._wait_for_operations(operations, progress=lambda _: bar.next())
+        self.ip_addresses = self._instance_ip_addresses()
+        self._write_instances_conf()
         logger.debug("deployed the container on gcp")
         self.__str__()
 
@@ -107,7 +209,7 @@ class GCP(Cloud):
         print("\n")
         print("successfully deployed the container image on gcp")
         print("## " + "=" * 70 + " ##")
-        print(f"public ip address       :: {self.ip_of_instance}")
+        print(f"public ip address       :: {', '.join(self.ip_addresses)}")
         print(f"instance user id        :: {self.username}")
         print(f"key file path           :: {utils.SSHkeys().private_key_path}")
         print(f"deployed docker image   :: {self.container_image_url}")
@@ -118,18 +220,82 @@ class GCP(Cloud):
         return ""
       
     def stop(self):
-        """delete the VM instance."""
+        """delete the VM instances of every deployment, and the instance of
+        deployments made before replicas were supported."""
         logger.debug("deleting instances, ssh keys and config files.")
         utils.SSHkeys().delete_ssh_keys()
         self._get_compute_client()
         self.project_id = self.ini_conf["GCP"].get("project_id")
         self.zone = self.ini_conf["GCP"].get("zone")
+        instance_names, instance_groups = self._deployed_resources()
         self._remove_config()
-        operation = self.__delete_instance()
-        logger.debug("delete instance on gcp")
-        self.__wait_for_operation(operation["name"])
+        if LEGACY_INSTANCE not in instance_names:
+            instance_names.append(LEGACY_INSTANCE)
+        logger.debug(
+            f"delete {len(instance_names)} instances and {len(instance_groups)} instance groups on gcp"
+        )
+        # deleting a managed instance group deletes its instances
+        requests = [
+            self.compute_client.instanceGroupManagers().delete(
+                project=self.project_id, zone=self.zone, instanceGroupManager=name
+            )
+            for name in instance_groups
+        ]
+        requests += [
+            self.compute_client.instances().delete(
+                project=self.project_id, zone=self.zone, instance=name
+            )
+            for name in instance_names
+        ]
+        operations = self._execute_batch(requests, ignore_statuses=(404,))
+        with MoonSpinner("Waiting for operation to complete...") as bar:
+            self._wait_for_operations(
+                [operation["name"] for operation in operations if operation],
+                progress=lambda _: bar.next(),
+            )
 
-    def __create_instance(self):
+    def status(self):
+        """report the instances and instance groups of recorded deployments, their
+        details are fetched in batches."""
+        self.project_id = self.ini_conf["GCP"].get("project_id")
+        self.zone = self.ini_conf["GCP"].get("zone")
+        self._get_compute_client()
+        names = []
+        groups = []
+        for section in self.ini_conf.sections():
+            if section.startswith("GCP-service"):
+                deployment = self.ini_conf[section]
+                if deployment.get("instance_group"):
+                    groups.append(deployment["instance_group"])
+                names += [name for name in deployment.get("instances", "").split(",") if name]
+        requests = [
+            self.compute_client.instanceGroupManagers().get(
+                project=self.project_id, zone=self.zone, instanceGroupManager=name
+            )
+            for name in groups
+        ]
+        requests += [
+            self.compute_client.instances().get(
+                project=self.project_id, zone=self.zone, instance=name
+            )
+            for name in names
+        ]
+        responses = self._execute_batch(requests, ignore_statuses=(404,))
+        for name, group in zip(groups, responses):
+            if group is None:
+                click.echo(f"{name}: deleted")
+                continue
+            stable = "stable" if group.get("status", {}).get("isStable") else "updating"
+            click.echo(f"{name}: {stable}, target size {group.get('targetSize')}")
+        for name, instance in zip(names, responses[len(groups):]):
+            if instance is None:
+                click.echo(f"{name}: deleted")
+                continue
+            access_configs = instance["networkInterfaces"][0].get("accessConfigs", [{}])
+            click.echo(f"{name}: {instance['status']}, {access_configs[0].get('natIP', '')}")
+
+    def _instance_properties(self):
+        """instance body shared by all replicas of a deployment, without a name."""
         try:
             # Get the latest Google COS image.
             image_response = (
@@ -140,10 +306,14 @@ class GCP(Cloud):
         except Exception as e:
             logger.error(f"error occured in fetching the image, exitinge, {e}")
             sys.exit(1)
-        source_disk_image = image_response["selfLink"]
-        config = {
-            "name": self.instance_name,
-            "machineType": f"zones/{self.zone}/machineTypes/{self.machine_type}",
+        properties = self._instance_body(image_response["selfLink"], self.deployment_name)
+        properties["labels"] = {DEPLOYMENT_LABEL: str(self.timestamp)}
+        return properties
+
+    def _instance_body(self, source_image, container_name):
+        """machine type, boot disk, network and container metadata of an instance."""
+        return {
+            "machineType": self.machine_type,
             "disks": [
                 {
                     "boot": True,
@@ -152,7 +322,7 @@ class GCP(Cloud):
                     'type': 'PERSISTENT',
                     "initializeParams": {
                         'diskSizeGb': 30,
-                        "sourceImage": source_disk_image,
+                        "sourceImage": source_image,
                     },
                 }
             ],
@@ -168,38 +338,339 @@ class GCP(Cloud):
                 "items": [
                     {
                         "key": "gce-container-declaration",
-                        "value": "\nspec:"
-                        +"\n  containers:"
-                        +"\n    - image: "+ self.container_image_url
-                        +"\n      name: " + self.instance_name
-                        +"\n      stdin: true"
-                        +"\n      tty: true"
-                        +"\n  restartPolicy: Always\n",
+                        "value": cloudinit.container_declaration(
+                            cloudinit.Container(self.container_image_url, self.env),
+                            container_name,
+                        ),
                     },
                     {"key": "ssh-keys", "value": "occt-user:" + self.public_ssh_key},
                 ]
             },
         }
 
+    def _create_instances(self):
+        """create all instances with one bulkInsert, or with batched inserts where
+        bulkInsert isn't available. Returns the names of the zone operations."""
+        properties = self._instance_properties()
         try:
-            return (
-                self.compute_client.instances()
-                .insert(project=self.project_id, zone=self.zone, body=config)
-                .execute()
+            try:
+                operation = (
+                    self.compute_client.instances()
+                    .bulkInsert(
+                        project=self.project_id,
+                        zone=self.zone,
+                        body={
+                            "count": len(self.instance_names),
+                            "minCount": len(self.instance_names),
+                            "perInstanceProperties": {name: {} for name in self.instance_names},
+                            "instanceProperties": properties,
+                        },
+                    )
+                    .execute()
+                )
+                return [operation["name"]]
+            except (AttributeError, HttpError) as e:
+                if not _bulk_insert_unsupported(e):
+                    raise
+                logger.debug(f"bulkInsert not available, inserting instances in a batch: {e}")
+            body = dict(
+                properties, machineType=f"zones/{self.zone}/machineTypes/{self.machine_type}"
+            )
+            operations = self._execute_batch(
+                [
+                    self.compute_client.instances().insert(
+                        project=self.project_id, zone=self.zone, body=dict(body, name=name)
+                    )
+                    for name in self.instance_names
+                ]
             )
+            return [operation["name"] for operation in operations]
         except Exception as e:
             logger.error(f"error in creating instance using the given details, {e}")
             sys.exit(1)
-        return None
 
-    def __delete_instance(self):
-        return (
-            self.compute_client.instances()
-            .delete(
-                project=self.project_id, zone=self.zone, instance=self.instance_name
+    def _create_instance_group(self, count, progress=None):
+        """create the managed instance group of the deployment and wait until it is stable.
+
+        The instance template, health check and its firewall rule are shared
+        by deployments and only created when missing, concurrently, each on
+        its own http connection. The deployment is recorded before waiting on
+        the group, so stop deletes it even when the wait times out.
+        """
+
+        def template():
+            self.instance_template = self._ensure_instance_template(
+                progress, http=authorized_http(self.credentials)
+            )
+
+        def health_check():
+            self.health_check = self._ensure_global_resource(
+                self.compute_client.healthChecks(),
+                "healthCheck",
+                {
+                    "name": HEALTH_CHECK,
+                    "type": "TCP",
+                    "tcpHealthCheck": {"port": HEALTH_CHECK_PORT},
+                    "checkIntervalSec": 10,
+                    "timeoutSec": 5,
+                    "healthyThreshold": 2,
+                    "unhealthyThreshold": 3,
+                },
+                progress,
+                http=authorized_http(self.credentials),
+            )
+
+        def firewall():
+            self._ensure_global_resource(
+                self.compute_client.firewalls(),
+                "firewall",
+                {
+                    "name": HEALTH_CHECK_FIREWALL,
+                    "network": "global/networks/default",
+                    "direction": "INGRESS",
+                    "sourceRanges": HEALTH_CHECK_RANGES,
+                    "allowed": [{"IPProtocol": "tcp", "ports": [str(HEALTH_CHECK_PORT)]}],
+                },
+                progress,
+                http=authorized_http(self.credentials),
+            )
+
+        def group():
+            operation = (
+                self.compute_client.instanceGroupManagers()
+                .insert(
+                    project=self.project_id,
+                    zone=self.zone,
+                    body={
+                        "name": self.instance_group,
+                        "baseInstanceName": self.deployment_name,
+                        "instanceTemplate": self.instance_template,
+                        "targetSize": count,
+                        "autoHealingPolicies": [
+                            {
+                                "healthCheck": self.health_check,
+                                "initialDelaySec": AUTOHEALING_DELAY,
+                            }
+                        ],
+                    },
+                )
+                .execute()
+            )
+            self.instance_names = []
+            self.ip_addresses = []
+            self._write_instances_conf()
+            self._wait_for_operations([operation["name"]], progress=progress)
+            self._wait_for_group(progress)
+
+        graph = StepGraph(
+            [
+                Step("template", template),
+                Step("health_check", health_check),
+                Step("firewall", firewall),
+                Step("group", group, requires=["template", "health_check", "firewall"]),
+            ]
+        )
+        try:
+            graph.run()
+        finally:
+            graph.log_critical_path()
+
+    def _ensure_instance_template(self, progress=None, http=None):
+        """instance template named by a hash of its properties, created if missing.
+
+        The boot disk refers to the image family, which resolves to its latest
+        image when instances are created, so no image lookup is needed.
+        """
+        properties = self._instance_body(
+            f"projects/{self.image_project}/global/images/family/{self.machine_image}",
+            "occt-container",
+        )
+        digest = hashlib.sha256(json.dumps(properties, sort_keys=True).encode()).hexdigest()
+        return self._ensure_global_resource(
+            self.compute_client.instanceTemplates(),
+            "instanceTemplate",
+            {"name": f"occt-template-{digest[:16]}", "properties": properties},
+            progress,
+            http=http,
+        )
+
+    def _ensure_global_resource(self, collection, key, body, progress=None, http=None):
+        """self link of the global resource named in body, inserted when it doesn't exist."""
+        try:
+            resource = collection.get(project=self.project_id, **{key: body["name"]}).execute(
+                http=http
+            )
+            logger.debug(f"reusing {key} {body['name']}")
+            return resource["selfLink"]
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+        operation = collection.insert(project=self.project_id, body=body).execute(http=http)
+        self._wait_for_operations(
+            [operation["name"]], progress=progress, scope="global", http=http
+        )
+        logger.debug(f"created {key} {body['name']}")
+        return operation["targetLink"]
+
+    def _wait_for_group(self, progress=None, timeout=OPERATION_TIMEOUT):
+        """wait until the instance group created or removed all of its instances."""
+        deadline = time.monotonic() + timeout
+        delays = utils.backoff_delays(initial=2.0, factor=1.5, maximum=15.0, jitter=0.2)
+        while True:
+            group = (
+                self.compute_client.instanceGroupManagers()
+                .get(
+                    project=self.project_id,
+                    zone=self.zone,
+                    instanceGroupManager=self.instance_group,
+                )
+                .execute()
+            )
+            if progress is not None:
+                progress(group)
+            if group.get("status", {}).get("isStable"):
+                return group
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(
+                    f"instance group {self.instance_group} not stable after {timeout}s"
+                )
+            time.sleep(min(next(delays), remaining))
+
+    def _group_instance_names(self):
+        response = (
+            self.compute_client.instanceGroupManagers()
+            .listManagedInstances(
+                project=self.project_id,
+                zone=self.zone,
+                instanceGroupManager=self.instance_group,
+            )
+            .execute()
+        )
+        return sorted(
+            managed["instance"].rsplit("/", 1)[-1]
+            for managed in response.get("managedInstances", [])
+        )
+
+    def scale(self, count: int):
+        """resize the instance group of the latest instance-group deployment."""
+        sections = [
+            section
+            for section in self.ini_conf.sections()
+            if section.startswith("GCP-service")
+            and self.ini_conf[section].get("instance_group")
+        ]
+        if not sections:
+            logger.error(
+                "No instance group deployment found, use start with --backend instance-group"
+            )
+            sys.exit(1)
+        deployment = self.ini_conf[sections[-1]]
+        self.project_id = self.ini_conf["GCP"].get("project_id")
+        self.zone = self.ini_conf["GCP"].get("zone")
+        self.username = "occt-user"
+        self._get_compute_client()
+        self.timestamp = sections[-1][len("GCP-service-"):]
+        self.instance_group = deployment["instance_group"]
+        self.deployment_name = f"occt-vm-{self.timestamp}"
+        logger.debug(f"Scaling {self.instance_group} to {count} instances.")
+        operation = (
+            self.compute_client.instanceGroupManagers()
+            .resize(
+                project=self.project_id,
+                zone=self.zone,
+                instanceGroupManager=self.instance_group,
+                size=count,
             )
             .execute()
         )
+        with MoonSpinner("Waiting for operation to complete...") as bar:
+            self._wait_for_operations([operation["name"]], progress=lambda _: bar.next())
+            self._wait_for_group(progress=lambda _: bar.next())
+        self.instance_names = self._group_instance_names()
+        self.ip_addresses = self._instance_ip_addresses()
+        self._write_instances_conf()
+        logger.info(f"Scaled {self.instance_group} to {count} instances.")
+
+    def _execute_batch(
+        self, requests, ignore_statuses=(), callback=None, http=None, deadline=None
+    ):
+        """execute independent requests BATCH_SIZE at a time, each batch in one http
+        round trip, and return their responses in request order.
+
+        callback is called with the index, response and error of every request.
+        http replaces the connection of the client, for batches sent from threads.
+        Batches not sent by the time.monotonic() deadline return None.
+        Requests failing with one of ignore_statuses return None, any other
+        error is raised once all batches ran.
+        """
+        responses = [None] * len(requests)
+        errors = []
+
+        def handle(request_id, response, exception):
+            index = int(request_id)
+            if callback is not None:
+                callback(index, response, exception)
+            if exception is None:
+                responses[index] = response
+            elif not (
+                isinstance(exception, HttpError) and exception.resp.status in ignore_statuses
+            ):
+                errors.append(exception)
+
+        for start in range(0, len(requests), BATCH_SIZE):
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            batch = self.compute_client.new_batch_http_request(callback=handle)
+            for index in range(start, min(start + BATCH_SIZE, len(requests))):
+                batch.add(requests[index], request_id=str(index))
+            batch.execute(http=http)
+        if errors:
+            raise errors[0]
+        return responses
+
+    def _instance_ip_addresses(self):
+        """public ips of the deployment's instances, in the order of instance_names."""
+        addresses = {}
+        instances = self.compute_client.instances()
+        request = instances.list(
+            project=self.project_id,
+            zone=self.zone,
+            filter=f'name eq "{self.deployment_name}-.*"',
+        )
+        while request is not None:
+            response = request.execute()
+            for item in response.get("items", []):
+                access_configs = item["networkInterfaces"][0].get("accessConfigs", [{}])
+                addresses[item["name"]] = access_configs[0].get("natIP", "")
+            request = instances.list_next(request, response)
+        return [addresses.get(name, "") for name in self.instance_names]
+
+    def _write_instances_conf(self):
+        self.ini_conf[f"GCP-service-{self.timestamp}"] = {
+            "instances": ",".join(self.instance_names),
+            "ssh_ip": ",".join(f"{self.username}@{ip}" for ip in self.ip_addresses),
+        }
+        if self.instance_group:
+            self.ini_conf[f"GCP-service-{self.timestamp}"]["instance_group"] = self.instance_group
+        with open(config.CONFIG_FILE, "w") as config_file:
+            self.ini_conf.write(config_file)
+
+    def _deployed_resources(self):
+        """instance and instance group names of all recorded deployments, their
+        sections are removed. Instances of a group are left to the group."""
+        names = []
+        groups = []
+        for section in self.ini_conf.sections():
+            if section.startswith("GCP-service"):
+                deployment = self.ini_conf[section]
+                if deployment.get("instance_group"):
+                    groups.append(deployment["instance_group"])
+                else:
+                    instances = deployment.get("instances", "")
+                    names += [name for name in instances.split(",") if name]
+                self.ini_conf.remove_section(section)
+        return names, groups
 
     def __list_instance_details(self):
         self._get_compute_client()
@@ -214,18 +685,64 @@ class GCP(Cloud):
             ][0]["natIP"]
         print("unrahul: list instances:: ", result)
 
-    def __wait_for_operation(self, operation):
-        with MoonSpinner("Waiting for operation to complete...") as bar:
-            while True:
-                result = (
-                    self.compute_client.zoneOperations()
-                    .get(project=self.project_id, zone=self.zone, operation=operation)
-                    .execute()
-                )
+    def _wait_for_operations(
+        self, operations, timeout=OPERATION_TIMEOUT, progress=None, scope="zone", http=None
+    ):
+        """wait until all zone, or global, operations are done and return them by name.
 
+        zoneOperations().wait blocks on the server until the operation is done
+        or about two minutes passed, the waits of all pending operations go out
+        in one batch. Operations still running after a round of waits, and
+        throttled or failed wait calls, batches and connections, are retried
+        after a jittered backoff. The deadline is checked between batches, so a
+        round of more than BATCH_SIZE waits stops early. progress is called
+        with every operation resource returned.
+        """
+        deadline = time.monotonic() + timeout
+        delays = utils.backoff_delays(initial=1.0, factor=2.0, maximum=30.0, jitter=0.2)
+        pending = list(operations)
+        results = {}
+        while True:
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"operations {', '.join(pending)} not done after {timeout}s")
+            if scope == "global":
+                requests = [
+                    self.compute_client.globalOperations().wait(
+                        project=self.project_id, operation=operation
+                    )
+                    for operation in pending
+                ]
+            else:
+                requests = [
+                    self.compute_client.zoneOperations().wait(
+                        project=self.project_id, zone=self.zone, operation=operation
+                    )
+                    for operation in pending
+                ]
+            try:
+                responses = self._execute_batch(
+                    requests, ignore_statuses=RETRYABLE_STATUSES, http=http, deadline=deadline
+                )
+            except HttpError as e:
+                if e.resp.status not in RETRYABLE_STATUSES:
+                    raise
+                logger.debug(f"operation wait batch failed with {e.resp.status}, retrying")
+                responses = [None] * len(pending)
+            except (OSError, httplib2.HttpLib2Error) as e:
+                # socket timeouts and connection resets of the long poll
+                logger.debug(f"operation wait batch failed with {e!r}, retrying")
+                responses = [None] * len(pending)
+            for operation, result in zip(list(pending), responses):
+                if result is None:
+                    logger.debug(f"waiting on {operation} failed, retrying")
+                    continue
+                if progress is not None:
+                    progress(result)
                 if result["status"] == "DONE":
                     if "error" in result:
                         raise Exception(result["error"])
-                    return result
-                time.sleep(0.5)
-                bar.next()
+                    pending.remove(operation)
+                    results[operation] = result
+            if not pending:
+                return results
+            time.sleep(max(0, min(next(delays), deadline - time.monotonic())))
@@ -1,24 +1,150 @@
-import base64
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import configparser
 import os
 import json
-from pathlib import Path
+import re
 import sys
 
+import click
+from azure.core.exceptions import ResourceNotFoundError
 from azure.mgmt.resource import ResourceManagementClient, SubscriptionClient
 from azure.mgmt.network import NetworkManagementClient
 from azure.mgmt.compute import ComputeManagementClient
-from azure.identity import DefaultAzureCredential
 from azure.mgmt.network.v2020_06_01.models import NetworkSecurityGroup, SecurityRule
 
 from onecontainer_cloud_tool.cloud.abstract_cloud import Cloud
+from onecontainer_cloud_tool.cloud.azure_auth import CachedTokenCredential, clear_token_cache
+from onecontainer_cloud_tool import cloudinit
 from onecontainer_cloud_tool import config
 from onecontainer_cloud_tool import utils
 from onecontainer_cloud_tool.logger import logger
+from onecontainer_cloud_tool.state import LocalState
+from onecontainer_cloud_tool.step_graph import Step, StepGraph
+
+# inbound rules of the network security group of a deployment
+SECURITY_RULES = [
+    {
+        "name": "http",
+        "access": "Allow",
+        "description": "allow inbound http",
+        "destination_address_prefix": "*",
+        "destination_port_range": "80",
+        "direction": "Inbound",
+        "priority": 505,
+        "protocol": "Tcp",
+        "source_address_prefix": "*",
+        "source_port_range": "80",
+    },
+    {
+        "name": "https",
+        "access": "Allow",
+        "description": "allow inbound https",
+        "destination_address_prefix": "*",
+        "destination_port_range": "443",
+        "direction": "Inbound",
+        "priority": 506,
+        "protocol": "Tcp",
+        "source_address_prefix": "*",
+        "source_port_range": "443",
+    },
+    {
+        "name": "ssh",
+        "access": "Allow",
+        "description": "allow inbound ssh",
+        "destination_address_prefix": "*",
+        "destination_port_range": "22",
+        "direction": "Inbound",
+        "priority": 500,
+        "protocol": "Tcp",
+        "source_address_prefix": "*",
+        "source_port_range": "22",
+    },
+    {
+        "name": "outgoing",
+        "access": "Allow",
+        "description": "allow outgoing traffic",
+        "destination_address_prefix": "*",
+        "destination_port_range": "*",
+        "direction": "Inbound",
+        "priority": 501,
+        "protocol": "Tcp",
+        "source_address_prefix": "*",
+        "source_port_range": "*",
+    },
+]
+# api versions of the resources in generated ARM templates
+NETWORK_API_VERSION = "2020-06-01"
+COMPUTE_API_VERSION = "2020-12-01"
+# first compute api version with a sku on scale set public ip configurations,
+# newer than the models of the pinned sdk, scale sets are deployed as templates
+SCALE_SET_API_VERSION = "2021-03-01"
+# ARM property names whose acronyms camel case doesn't reproduce
+ARM_PROPERTY_NAMES = {"publicIpAddressConfiguration": "publicIPAddressConfiguration"}
+DEPLOYMENT_MODES = ("vm", "arm-template", "scale-set")
+# long-lived resource group with the vnet, subnet and nsg of shared network deployments
+SHARED_NETWORK_PREFIX = "onecontainer-shared"
+# resource group deletions awaited at the same time by stop
+DELETE_CONCURRENCY = 8
+# resource groups whose deletion was started by stop --no-wait
+PENDING_DELETIONS_SECTION = "AZURE-pending-deletions"
+# valid locations and vm sizes per location, cached by subscription
+METADATA_TTL = 24 * 60 * 60
+metadata_state = LocalState("azure-metadata")
+# shared image gallery holding the images captured by bake, one per region
+IMAGE_GALLERY_PREFIX = "onecontainer-images"
+IMAGE_GALLERY = "onecontainer_gallery"
+IMAGE_DEFINITION = "onecontainer-docker"
+# commands run on the bake vm once it is provisioned, before it is captured
+BAKE_COMMANDS = [
+    "cloud-init status --wait",
+    "cloud-init clean --logs",
+    "waagent -deprovision+user -force",
+]
+# latest baked image version by subscription and region
+image_state = LocalState("azure-images")
+# tag put on every resource group the tool creates, its value is the group's role
+MANAGED_TAG = "onecontainer-cloud-tool"
+
+
+def iter_subscriptions(subscription_client, state="Enabled"):
+    """stream the subscriptions of the tenant in the given state.
+
+    Pages are requested only as the generator is consumed, callers that stop
+    early never list the remaining subscriptions.
+    """
+    for page in subscription_client.subscriptions.list().by_page():
+        for subscription in page:
+            if state is None or subscription.state == state:
+                yield subscription
+
+
+def iter_resource_groups(resource_client, role=None):
+    """stream the resource groups created by the tool, filtered by tag on the server."""
+    query = f"tagName eq '{MANAGED_TAG}'"
+    if role is not None:
+        query += f" and tagValue eq '{role}'"
+    for page in resource_client.resource_groups.list(filter=query).by_page():
+        for resource_group in page:
+            yield resource_group
+
+
+def _camel_case(value):
+    """convert the snake_case keys of sdk request bodies to ARM template properties."""
+    if isinstance(value, dict):
+        converted = {}
+        for key, item in value.items():
+            key = re.sub(r"_([a-z])", lambda match: match.group(1).upper(), key)
+            converted[ARM_PROPERTY_NAMES.get(key, key)] = _camel_case(item)
+        return converted
+    if isinstance(value, list):
+        return [_camel_case(item) for item in value]
+    return value
 
 
 class Azure(Cloud):
     """deploy container solutions on azure cloud."""
+    username = "azureuser"
+
     def __init__(self):
         self.ini_conf = configparser.ConfigParser()
         try:
@@ -26,38 +152,77 @@ class Azure(Cloud):
         except IOError as e:
             logger.error(f"config file not found: {e}")
 
-    def initialize(self, region):
-        """initialize and setup keys."""
-        try:
-            credential = DefaultAzureCredential(exclude_interactive_browser_credential=False, exclude_managed_identity_credential=True, exclude_shared_token_cache_credential=True)
+    def initialize(self, region, subscription=None):
+        """initialize and setup keys.
 
+        subscription is an id or display name, the first enabled subscription
+        of the tenant is used without one.
+        """
+        try:
+            # log in again, walking the whole credential chain
+            clear_token_cache()
+            credential = CachedTokenCredential()
             subscription_client = SubscriptionClient(credential)
-            Azure._get_subscription_id(subscription_client)
+            Azure._get_subscription_id(subscription_client, subscription)
             Azure._validate_region(region, subscription_client, self.sub_id)
             utils.SSHkeys()
-            self._save_session(region)
+            self._save_session(region, credential.successful_credential_type)
+        except ValueError as e:
+            logger.error(e)
+            sys.exit(1)
         except Exception as e:
             logger.error("Could not log in with Azure, try writing the Environment variables, doing az login (requires azure cli) or with browser.")
 
     @classmethod
-    def _get_subscription_id(cls, subscription_client):
-        subs = [
-            sub.subscription_id for sub in subscription_client.subscriptions.list()
-        ]
-        cls.sub_id = subs[0]
+    def _get_subscription_id(cls, subscription_client, subscription=None):
+        for sub in iter_subscriptions(subscription_client):
+            if subscription in (None, sub.subscription_id, sub.display_name):
+                cls.sub_id = sub.subscription_id
+                return
+        if subscription is None:
+            raise ValueError("No enabled azure subscription found")
+        raise ValueError(f"Subscription {subscription} not found or not enabled")
 
     @staticmethod
     def _validate_region(region, subscription_client, subscription_id):
-        locations = subscription_client.subscriptions.list_locations(subscription_id)
-        valid_region = False
-        for location in locations:
-            if(location.name==region):
-                valid_region = True
-                break
-        if not valid_region:
+        locations = Azure._cached_metadata(
+            f"{subscription_id}:locations",
+            lambda: [
+                location.name
+                for location in subscription_client.subscriptions.list_locations(subscription_id)
+            ],
+            region,
+        )
+        if region not in locations:
             raise ValueError("Specified region is not valid")
 
-    def _save_session(self, region):
+    def _validate_instance_type(self, compute_client, instance_type):
+        """check the vm size against the sizes offered in the location, before
+        any resource is created."""
+        sizes = Azure._cached_metadata(
+            f"{self.sub_id}:vm_sizes:{self.location}",
+            lambda: [
+                size.name
+                for size in compute_client.virtual_machine_sizes.list(self.location)
+            ],
+            instance_type,
+        )
+        if instance_type not in sizes:
+            raise ValueError(
+                f"instance type {instance_type} is not available in {self.location}"
+            )
+
+    @staticmethod
+    def _cached_metadata(key, fetch, expected=None):
+        """names cached under key for METADATA_TTL seconds, fetched again once when
+        expected is missing from the cached list."""
+        names = metadata_state.get(key, ttl=METADATA_TTL)
+        if names is None or (expected is not None and expected not in names):
+            names = fetch()
+            metadata_state.set(key, names)
+        return names
+
+    def _save_session(self, region, credential_type=None):
         logger.debug(
             f"Writing {region} as region for AZURE in {config.CONFIG_FILE}"
         )
@@ -65,7 +230,10 @@ class Azure(Cloud):
         logger.info("Initialization Successful")
         self.ini_conf["AZURE"] = {
             "REGION": region,
+            "SUBSCRIPTION_ID": self.sub_id,
         }
+        if credential_type:
+            self.ini_conf["AZURE"]["CREDENTIAL_TYPE"] = credential_type
         with open(config.CONFIG_FILE, "w") as config_file:
             self.ini_conf.write(config_file)
 
@@ -75,13 +243,36 @@ class Azure(Cloud):
             return self.ini_conf["AZURE"].get("REGION", "eastus")
         return None
 
-    def deploy(self, instance_type: str, container_image: str, machine_image="UbuntuServer"):
-        """deploy a container image with a user provided hardware instance."""
+    def deploy(
+        self,
+        instance_type: str,
+        container_image: str,
+        machine_image="UbuntuServer",
+        mode: str = "vm",
+        shared_network: bool = False,
+        count: int = 1,
+        use_baked_image: bool = True,
+        env=(),
+        run_flags=(),
+        extra_images=(),
+    ):
+        """deploy a container image with a user provided hardware instance.
+
+        mode "vm" provisions each resource with its own sdk call, "arm-template"
+        submits all of them in a single ARM template deployment, "scale-set"
+        creates count identical vms with a single virtual machine scale set. With
+        shared_network the vnet, subnet and nsg are reused from the
+        onecontainer-shared-<region> resource group, which stop never deletes.
+        When bake captured an image for the region, vms boot from it and only
+        run the container. extra_images run next to container_image, all of
+        them with the env entries (KEY=VALUE) and docker run flags.
+        """
+        if mode not in DEPLOYMENT_MODES:
+            raise ValueError(f"unknown azure deployment mode {mode}")
         try:
             utils.check_config_exists(config)
             credential = self._get_stored_session()
-            subscription_client = SubscriptionClient(credential)
-            Azure._get_subscription_id(subscription_client)
+            self._load_subscription_id(credential)
             resource_client = ResourceManagementClient(credential, self.sub_id)
             network_client = NetworkManagementClient(credential, self.sub_id)
             compute_client = ComputeManagementClient(credential, self.sub_id)
@@ -89,23 +280,84 @@ class Azure(Cloud):
             logger.error(e)
             logger.error("Could not get session, please run init command")
             sys.exit()
+        try:
+            self._validate_instance_type(compute_client, instance_type)
+        except ValueError as e:
+            logger.error(e)
+            sys.exit(1)
         self._generate_resources_names()
+        self.mode = mode
+        if use_baked_image:
+            self.baked_image_id = (image_state.get(self._image_key()) or {}).get("id")
+        if shared_network:
+            self._use_shared_network()
+            self._create_resource_group(
+                resource_client, self.network_resource_group_name, role="shared-network"
+            )
         self._create_resource_group(resource_client)
-        ip_address_result, nic_result = self._provision_network_resources(network_client)
-        self.ip_address = ip_address_result.ip_address
-        CUSTOM_DATA = self._get_cloud_init_script(container_image)
-        self._provision_vm(compute_client, machine_image, instance_type, nic_result, CUSTOM_DATA)
+        containers = tuple(
+            cloudinit.Container(image, env, run_flags)
+            for image in (container_image,) + tuple(extra_images)
+        )
+        if self.baked_image_id:
+            logger.debug(f"Booting from baked image {self.baked_image_id}")
+        CUSTOM_DATA = cloudinit.custom_data(
+            containers, install_docker=not self.baked_image_id
+        )
+        if mode == "arm-template":
+            if shared_network:
+                StepGraph(self._shared_network_steps(network_client)).run()
+            self.ip_addresses = [
+                self._deploy_template(resource_client, machine_image, instance_type, CUSTOM_DATA)
+            ]
+        else:
+            if mode == "scale-set":
+                steps = self._scale_set_steps(
+                    network_client, resource_client, machine_image, instance_type, CUSTOM_DATA, count
+                )
+            else:
+                steps = self._deploy_steps(
+                    network_client, compute_client, machine_image, instance_type, CUSTOM_DATA
+                )
+            graph = StepGraph(steps)
+            try:
+                graph.run()
+            finally:
+                graph.log_critical_path()
+            if mode == "scale-set":
+                self.ip_addresses = self._scale_set_ip_addresses(
+                    network_client, self.resource_group_name, self.scale_set_name
+                )
+            else:
+                self.ip_addresses = [self.ip_address_result.ip_address]
         self._write_deployment_conf()
         logger.info("Success!")
         logger.info("You can access the deployed solution via SSH")
-        logger.info(f"{self.username}@{self.ip_address}")
+        for ip_address in self.ip_addresses:
+            logger.info(f"{self.username}@{ip_address}")
         logger.info(
             f"Use the private key file generated to authenticate in the ssh connection"
         )
 
+    def _session_setting(self, name):
+        """setting stored at init, kept with the pending deletions once stop
+        removed the session so status checks the same subscription."""
+        for section in ("AZURE", PENDING_DELETIONS_SECTION):
+            if self.ini_conf.has_section(section) and self.ini_conf[section].get(name):
+                return self.ini_conf[section].get(name)
+        return None
+
     def _get_stored_session(self):
-        """return stored session."""
-        return  DefaultAzureCredential(exclude_interactive_browser_credential=False, exclude_managed_identity_credential=True, exclude_shared_token_cache_credential=True)
+        """return stored session, built from the credential type that succeeded at init."""
+        return CachedTokenCredential(self._session_setting("CREDENTIAL_TYPE"))
+
+    def _load_subscription_id(self, credential):
+        """use the subscription stored at init, listing subscriptions only without one."""
+        sub_id = self._session_setting("SUBSCRIPTION_ID")
+        if sub_id:
+            self.sub_id = sub_id
+        else:
+            Azure._get_subscription_id(SubscriptionClient(credential))
 
     def _generate_resources_names(self):
         """set resource names."""
@@ -118,27 +370,145 @@ class Azure(Cloud):
         self.nic_name = f"onecontainer-nic-{self.timestamp}"
         self.nsg_name = f"onecontainer-nsg-{self.timestamp}"
         self.vm_name = f"onecontainer-vm-{self.timestamp}"
-        self.username = "azureuser"
+        self.scale_set_name = f"onecontainer-vmss-{self.timestamp}"
+        self.mode = "vm"
+        self.baked_image_id = None
+        # resource group of the vnet, subnet and nsg
+        self.network_resource_group_name = self.resource_group_name
+        self.shared_network = False
+
+    def _use_shared_network(self):
+        """take the vnet, subnet and nsg from the shared resource group of the region."""
+        self.shared_network = True
+        self.network_resource_group_name = f"{SHARED_NETWORK_PREFIX}-{self.location}"
+        self.vnet_name = f"{SHARED_NETWORK_PREFIX}-vnet"
+        self.subnet_name = f"{SHARED_NETWORK_PREFIX}-subnet"
+        self.nsg_name = f"{SHARED_NETWORK_PREFIX}-nsg"
+        # the subnet and nsg results stay unset until the shared network steps ran
+        self.subnet_result = None
+        self.nsg_result = None
 
-    def _create_resource_group(self, resource_client):
+    def _create_resource_group(self, resource_client, resource_group_name=None, role="deployment"):
         rg_result = resource_client.resource_groups.create_or_update(
-            self.resource_group_name, {"location": self.location}
+            resource_group_name or self.resource_group_name,
+            {"location": self.location, "tags": {MANAGED_TAG: role}},
         )
         logger.debug(
             f"Provisioned resource group {rg_result.name} in the {rg_result.location} region"
         )
 
-    def _provision_network_resources(self, network_client):
-        self._provision_vnet(network_client)
-        subnet_result = self._create_subnet(network_client)
-        ip_address_result = self._provision_ip_address(network_client)
-        nsg_result = self._create_security_group(network_client)
-        nic_result = self._provision_nic(network_client, subnet_result, ip_address_result, nsg_result)
-        return (ip_address_result, nic_result)
+    def _deploy_steps(
+        self, network_client, compute_client, machine_image, instance_type, custom_data
+    ):
+        """long-running operations of a deployment and what each of them waits for.
+
+        The public ip and the nsg don't depend on the vnet, their pollers run
+        while the vnet and subnet are provisioned.
+        """
+
+        def ip_address():
+            self.ip_address_result = self._provision_ip_address(network_client)
+
+        def nic():
+            self.nic_result = self._provision_nic(
+                network_client, self.subnet_result, self.ip_address_result, self.nsg_result
+            )
+
+        def vm():
+            self._provision_vm(
+                compute_client, machine_image, instance_type, self.nic_result, custom_data
+            )
+
+        return self._network_steps(network_client) + [
+            Step("ip_address", ip_address),
+            Step("nic", nic, requires=["subnet", "ip_address", "nsg"]),
+            Step("vm", vm, requires=["nic"]),
+        ]
+
+    def _network_steps(self, network_client):
+        """steps leaving the subnet and nsg of the deployment in subnet_result and nsg_result."""
+        if self.shared_network:
+            return self._shared_network_steps(network_client)
+
+        def subnet():
+            self.subnet_result = self._create_subnet(network_client)
+
+        def nsg():
+            self.nsg_result = self._create_security_group(network_client)
+
+        return [
+            Step("vnet", lambda: self._provision_vnet(network_client)),
+            Step("subnet", subnet, requires=["vnet"]),
+            Step("nsg", nsg),
+        ]
+
+    def _scale_set_steps(
+        self, network_client, resource_client, machine_image, instance_type, custom_data, count
+    ):
+        """network steps followed by the scale set, whose vms get their own public ips."""
+
+        def scale_set():
+            logger.debug(
+                f"Provisioning scale set {self.scale_set_name} with {count} instances; this operation might take a few minutes."
+            )
+            poller = resource_client.deployments.begin_create_or_update(
+                self.resource_group_name,
+                f"onecontainer-scale-set-{self.timestamp}",
+                {
+                    "properties": {
+                        "mode": "Incremental",
+                        "template": self._scale_set_template(
+                            machine_image,
+                            instance_type,
+                            count,
+                            self.subnet_result.id,
+                            self.nsg_result.id,
+                            custom_data,
+                        ),
+                        "parameters": {},
+                    }
+                },
+            )
+            deployment = poller.result()
+            logger.debug(f"Provisioned scale set {self.scale_set_name} with {deployment.name}")
+
+        return self._network_steps(network_client) + [
+            Step("scale_set", scale_set, requires=["subnet", "nsg"]),
+        ]
+
+    def _shared_network_steps(self, network_client):
+        """look up the shared subnet and nsg, creating them on the first deployment."""
+
+        def subnet():
+            try:
+                self.subnet_result = network_client.subnets.get(
+                    self.network_resource_group_name, self.vnet_name, self.subnet_name
+                )
+                logger.debug(f"Reusing shared subnet {self.subnet_result.name}")
+            except ResourceNotFoundError:
+                # a PUT of an existing vnet would replace its subnets
+                try:
+                    network_client.virtual_networks.get(
+                        self.network_resource_group_name, self.vnet_name
+                    )
+                except ResourceNotFoundError:
+                    self._provision_vnet(network_client)
+                self.subnet_result = self._create_subnet(network_client)
+
+        def nsg():
+            try:
+                self.nsg_result = network_client.network_security_groups.get(
+                    self.network_resource_group_name, self.nsg_name
+                )
+                logger.debug(f"Reusing shared network security group {self.nsg_result.name}")
+            except ResourceNotFoundError:
+                self.nsg_result = self._create_security_group(network_client)
+
+        return [Step("subnet", subnet), Step("nsg", nsg)]
 
     def _provision_vnet(self, network_client):
         poller = network_client.virtual_networks.begin_create_or_update(
-            self.resource_group_name,
+            self.network_resource_group_name,
             self.vnet_name,
             {
                 "location": self.location,
@@ -153,7 +523,7 @@ class Azure(Cloud):
 
     def _create_subnet(self, network_client):
         poller = network_client.subnets.begin_create_or_update(
-            self.resource_group_name,
+            self.network_resource_group_name,
             self.vnet_name,
             self.subnet_name,
             {"address_prefix": "10.0.0.0/24"},
@@ -183,62 +553,13 @@ class Azure(Cloud):
         return ip_address_result
 
     def _create_security_group(self, network_client):
-        security_rules = [
-            SecurityRule(
-                name="http",
-                access="Allow",
-                description="allow inbound http",
-                destination_address_prefix="*",
-                destination_port_range="80",
-                direction="Inbound",
-                priority=505,
-                protocol="Tcp",
-                source_address_prefix="*",
-                source_port_range="80",
-            ),
-            SecurityRule(
-                name="https",
-                access="Allow",
-                description="allow inbound https",
-                destination_address_prefix="*",
-                destination_port_range="443",
-                direction="Inbound",
-                priority=506,
-                protocol="Tcp",
-                source_address_prefix="*",
-                source_port_range="443",
-            ),
-            SecurityRule(
-                name="ssh",
-                access="Allow",
-                description="allow inbound ssh",
-                destination_address_prefix="*",
-                destination_port_range="22",
-                direction="Inbound",
-                priority=500,
-                protocol="Tcp",
-                source_address_prefix="*",
-                source_port_range="22",
-            ),
-            SecurityRule(
-                name="outgoing",
-                access="Allow",
-                description="allow outgoing traffic",
-                destination_address_prefix="*",
-                destination_port_range="*",
-                direction="Inbound",
-                priority=501,
-                protocol="Tcp",
-                source_address_prefix="*",
-                source_port_range="*",
-            ),
-        ]
+        security_rules = [SecurityRule(**rule) for rule in SECURITY_RULES]
 
         nsg_params = NetworkSecurityGroup(
             location=self.location, security_rules=security_rules
         )
         poller = network_client.network_security_groups.begin_create_or_update(
-            self.resource_group_name, self.nsg_name, nsg_params
+            self.network_resource_group_name, self.nsg_name, nsg_params
         )
         nsg_result = poller.result()
         logger.debug(
@@ -267,19 +588,6 @@ class Azure(Cloud):
         return nic_result
 
 
-    @staticmethod
-    def _get_cloud_init_script(container_image):
-        """get prebaked cloud init script to install container daemon and provision container."""
-        path: Path = Path(__file__).resolve().parents[1] / "data" / "azure-cloudinit"
-        with open(path, "r") as cloud_init_file:
-            cloud_init_data = (
-                cloud_init_file.read()
-                .replace("{{docker-image}}", container_image)
-                .encode()
-            )
-            return base64.b64encode(cloud_init_data).decode("latin-1")
-
-
     def _provision_vm(self, compute_client, machine_image, instance_type, nic_result, custom_data):
         """deply virtual machine on azure."""
         logger.debug(
@@ -288,69 +596,482 @@ class Azure(Cloud):
         poller = compute_client.virtual_machines.begin_create_or_update(
             self.resource_group_name,
             self.vm_name,
-            {
-                "location": self.location,
-                "storage_profile": {
-                    "image_reference": {
-                        "publisher": "Canonical",
-                        "offer": machine_image,
-                        "sku": "16.04.0-LTS",
-                        "version": "latest",
-                    }
+            self._vm_parameters(machine_image, instance_type, nic_result.id, custom_data),
+        )
+        vm_result = poller.result()
+        logger.debug(f"Provisioned virtual machine {vm_result.name}")
+
+    def _vm_parameters(self, machine_image, instance_type, nic_id, custom_data):
+        """virtual machine request body, shared by the sdk and ARM template deployments."""
+        image_reference = {
+            "publisher": "Canonical",
+            "offer": machine_image,
+            "sku": "16.04.0-LTS",
+            "version": "latest",
+        }
+        if self.baked_image_id:
+            image_reference = {"id": self.baked_image_id}
+        return {
+            "location": self.location,
+            "storage_profile": {"image_reference": image_reference},
+            "hardware_profile": {"vm_size": instance_type},
+            "os_profile": {
+                "custom_data": custom_data,
+                "computer_name": self.vm_name,
+                "admin_username": self.username,
+                "linux_configuration": {
+                    "disable_password_authentication": True,
+                    "ssh": {
+                        "public_keys": [
+                            {
+                                "path": f"/home/{self.username}/.ssh/authorized_keys",
+                                "key_data": utils.SSHkeys().public_key,
+                            }
+                        ]
+                    },
                 },
-                "hardware_profile": {"vm_size": instance_type},
-                "os_profile": {
-                    "custom_data": custom_data,
-                    "computer_name": self.vm_name,
-                    "admin_username": self.username,
-                    "linux_configuration": {
-                        "disable_password_authentication": True,
-                        "ssh": {
-                            "public_keys": [
+            },
+            "network_profile": {
+                "network_interfaces": [
+                    {
+                        "id": nic_id,
+                    }
+                ]
+            },
+        }
+
+    def _scale_set_parameters(
+        self, machine_image, instance_type, count, subnet_id, nsg_id, custom_data
+    ):
+        """scale set request body, built from the storage and os profiles of a single vm."""
+        vm_parameters = self._vm_parameters(machine_image, instance_type, None, custom_data)
+        os_profile = vm_parameters["os_profile"]
+        os_profile["computer_name_prefix"] = os_profile.pop("computer_name")
+        return {
+            "location": self.location,
+            "sku": {"name": instance_type, "tier": "Standard", "capacity": count},
+            "upgrade_policy": {"mode": "Manual"},
+            "virtual_machine_profile": {
+                "storage_profile": vm_parameters["storage_profile"],
+                "os_profile": os_profile,
+                "network_profile": {
+                    "network_interface_configurations": [
+                        {
+                            "name": self.nic_name,
+                            "primary": True,
+                            "network_security_group": {"id": nsg_id},
+                            "ip_configurations": [
                                 {
-                                    "path": f"/home/{self.username}/.ssh/authorized_keys",
-                                    "key_data": utils.SSHkeys().public_key,
+                                    "name": self.ip_config_name,
+                                    "subnet": {"id": subnet_id},
+                                    "public_ip_address_configuration": {
+                                        "name": self.ip_name,
+                                        "idle_timeout_in_minutes": 15,
+                                        "sku": {"name": "Standard", "tier": "Regional"},
+                                    },
                                 }
-                            ]
-                        },
-                    },
+                            ],
+                        }
+                    ]
                 },
-                "network_profile": {
-                    "network_interfaces": [
+            },
+        }
+
+    def _scale_set_template(
+        self, machine_image, instance_type, count, subnet_id, nsg_id, custom_data
+    ):
+        """ARM template of the scale set, at an api version that gives the vms
+        Standard public ips like the vm and arm-template backends."""
+        properties = self._scale_set_parameters(
+            machine_image, instance_type, count, subnet_id, nsg_id, custom_data
+        )
+        location = properties.pop("location")
+        sku = properties.pop("sku")
+        return {
+            "$schema": "https://schema.management.azure.com/schemas/2019-04-01/deploymentTemplate.json#",
+            "contentVersion": "1.0.0.0",
+            "resources": [
+                {
+                    "type": "Microsoft.Compute/virtualMachineScaleSets",
+                    "apiVersion": SCALE_SET_API_VERSION,
+                    "name": self.scale_set_name,
+                    "location": location,
+                    "sku": _camel_case(sku),
+                    "properties": _camel_case(properties),
+                }
+            ],
+        }
+
+    @staticmethod
+    def _scale_set_ip_addresses(network_client, resource_group_name, scale_set_name):
+        return [
+            ip.ip_address
+            for ip in network_client.public_ip_addresses.list_virtual_machine_scale_set_public_ip_addresses(
+                resource_group_name, scale_set_name
+            )
+            if ip.ip_address
+        ]
+
+    def _arm_template(self, machine_image, instance_type, custom_data):
+        """ARM template with the resource group contents of a deployment.
+
+        Resources keep the names from _generate_resources_names and Resource
+        Manager orders their creation from the dependsOn references. With a
+        shared network the template only holds the public ip, nic and vm, the
+        nic references the existing shared subnet and nsg by id.
+        """
+        vnet_id = f"[resourceId('Microsoft.Network/virtualNetworks', '{self.vnet_name}')]"
+        subnet_id = (
+            "[resourceId('Microsoft.Network/virtualNetworks/subnets', "
+            f"'{self.vnet_name}', '{self.subnet_name}')]"
+        )
+        ip_resource_id = f"resourceId('Microsoft.Network/publicIPAddresses', '{self.ip_name}')"
+        ip_id = f"[{ip_resource_id}]"
+        nsg_id = f"[resourceId('Microsoft.Network/networkSecurityGroups', '{self.nsg_name}')]"
+        nic_id = f"[resourceId('Microsoft.Network/networkInterfaces', '{self.nic_name}')]"
+        vm_properties = self._vm_parameters(machine_image, instance_type, nic_id, custom_data)
+        vm_properties.pop("location")
+        network_resources = [
+            {
+                "type": "Microsoft.Network/virtualNetworks",
+                "apiVersion": NETWORK_API_VERSION,
+                "name": self.vnet_name,
+                "location": self.location,
+                "properties": {"addressSpace": {"addressPrefixes": ["10.0.0.0/16"]}},
+            },
+            {
+                "type": "Microsoft.Network/virtualNetworks/subnets",
+                "apiVersion": NETWORK_API_VERSION,
+                "name": f"{self.vnet_name}/{self.subnet_name}",
+                "dependsOn": [vnet_id],
+                "properties": {"addressPrefix": "10.0.0.0/24"},
+            },
+            {
+                "type": "Microsoft.Network/networkSecurityGroups",
+                "apiVersion": NETWORK_API_VERSION,
+                "name": self.nsg_name,
+                "location": self.location,
+                "properties": {
+                    "securityRules": [
                         {
-                            "id": nic_result.id,
+                            "name": rule["name"],
+                            "properties": _camel_case(
+                                {key: value for key, value in rule.items() if key != "name"}
+                            ),
                         }
+                        for rule in SECURITY_RULES
                     ]
                 },
             },
+        ]
+        nic_depends_on = [subnet_id, ip_id, nsg_id]
+        if self.shared_network:
+            network_resources = []
+            subnet_id = self.subnet_result.id
+            nsg_id = self.nsg_result.id
+            nic_depends_on = [ip_id]
+        return {
+            "$schema": "https://schema.management.azure.com/schemas/2019-04-01/deploymentTemplate.json#",
+            "contentVersion": "1.0.0.0",
+            "resources": network_resources + [
+                {
+                    "type": "Microsoft.Network/publicIPAddresses",
+                    "apiVersion": NETWORK_API_VERSION,
+                    "name": self.ip_name,
+                    "location": self.location,
+                    "sku": {"name": "Standard"},
+                    "properties": {
+                        "publicIPAllocationMethod": "Static",
+                        "publicIPAddressVersion": "IPv4",
+                    },
+                },
+                {
+                    "type": "Microsoft.Network/networkInterfaces",
+                    "apiVersion": NETWORK_API_VERSION,
+                    "name": self.nic_name,
+                    "location": self.location,
+                    "dependsOn": nic_depends_on,
+                    "properties": {
+                        "ipConfigurations": [
+                            {
+                                "name": self.ip_config_name,
+                                "properties": {
+                                    "subnet": {"id": subnet_id},
+                                    "publicIPAddress": {"id": ip_id},
+                                },
+                            }
+                        ],
+                        "networkSecurityGroup": {"id": nsg_id},
+                    },
+                },
+                {
+                    "type": "Microsoft.Compute/virtualMachines",
+                    "apiVersion": COMPUTE_API_VERSION,
+                    "name": self.vm_name,
+                    "location": self.location,
+                    "dependsOn": [nic_id],
+                    "properties": _camel_case(vm_properties),
+                },
+            ],
+            "outputs": {
+                "ipAddress": {
+                    "type": "string",
+                    "value": f"[reference({ip_resource_id}).ipAddress]",
+                }
+            },
+        }
+
+    def _deploy_template(self, resource_client, machine_image, instance_type, custom_data):
+        """submit the deployment as one ARM template and return the public ip address."""
+        logger.debug(
+            f"Deploying template to {self.resource_group_name}; this operation might take a few minutes."
         )
-        vm_result = poller.result()
-        logger.debug(f"Provisioned virtual machine {vm_result.name}")
+        poller = resource_client.deployments.begin_create_or_update(
+            self.resource_group_name,
+            f"onecontainer-deployment-{self.timestamp}",
+            {
+                "properties": {
+                    "mode": "Incremental",
+                    "template": self._arm_template(machine_image, instance_type, custom_data),
+                    "parameters": {},
+                }
+            },
+        )
+        deployment = poller.result()
+        logger.debug(f"Provisioned template deployment {deployment.name}")
+        return deployment.properties.outputs["ipAddress"]["value"]
+
+    def bake(self, instance_type: str, images, machine_image="UbuntuServer"):
+        """capture a machine image with docker installed and images pulled.
+
+        A temporary vm runs the bake cloud-init, is generalized and captured
+        into a version of the shared image gallery of the region, its resource
+        group is deleted afterwards. Later deployments boot from the version.
+        """
+        try:
+            utils.check_config_exists(config)
+            credential = self._get_stored_session()
+            self._load_subscription_id(credential)
+            resource_client = ResourceManagementClient(credential, self.sub_id)
+            network_client = NetworkManagementClient(credential, self.sub_id)
+            compute_client = ComputeManagementClient(credential, self.sub_id)
+        except Exception as e:
+            logger.error(e)
+            logger.error("Could not get session, please run init command")
+            sys.exit()
+        try:
+            self._validate_instance_type(compute_client, instance_type)
+        except ValueError as e:
+            logger.error(e)
+            sys.exit(1)
+        self._generate_resources_names()
+        self.gallery_resource_group_name = f"{IMAGE_GALLERY_PREFIX}-{self.location}"
+        self._create_resource_group(
+            resource_client, self.gallery_resource_group_name, role="images"
+        )
+        self._create_resource_group(resource_client, role="bake")
+        custom_data = cloudinit.custom_data(pull_images=tuple(images))
+        try:
+            graph = StepGraph(
+                self._deploy_steps(
+                    network_client, compute_client, machine_image, instance_type, custom_data
+                )
+                + self._gallery_steps(compute_client, machine_image)
+            )
+            try:
+                graph.run()
+            finally:
+                graph.log_critical_path()
+            self._generalize_vm(compute_client)
+            image_id = self._capture_image_version(compute_client)
+        finally:
+            self._remove_resource_groups(resource_client, [self.resource_group_name])
+        image_state.set(self._image_key(), {"id": image_id, "images": list(images)})
+        logger.info(f"Baked image {image_id}")
+
+    def _image_key(self):
+        return f"{self.sub_id}/{self.location}"
+
+    def _gallery_steps(self, compute_client, machine_image):
+        """gallery and image definition, created while the bake vm provisions."""
+
+        def gallery():
+            compute_client.galleries.begin_create_or_update(
+                self.gallery_resource_group_name, IMAGE_GALLERY, {"location": self.location}
+            ).result()
+
+        def image_definition():
+            compute_client.gallery_images.begin_create_or_update(
+                self.gallery_resource_group_name,
+                IMAGE_GALLERY,
+                IMAGE_DEFINITION,
+                {
+                    "location": self.location,
+                    "os_type": "Linux",
+                    "os_state": "Generalized",
+                    "identifier": {
+                        "publisher": "onecontainer",
+                        "offer": machine_image,
+                        "sku": "docker",
+                    },
+                },
+            ).result()
+
+        return [
+            Step("gallery", gallery),
+            Step("image_definition", image_definition, requires=["gallery"]),
+        ]
+
+    def _generalize_vm(self, compute_client):
+        """wait for the bake cloud-init to finish, then deprovision and generalize the vm."""
+        logger.debug(f"Waiting for cloud-init on {self.vm_name} to install docker and pull images.")
+        compute_client.virtual_machines.begin_run_command(
+            self.resource_group_name,
+            self.vm_name,
+            {"command_id": "RunShellScript", "script": BAKE_COMMANDS},
+        ).result()
+        compute_client.virtual_machines.begin_deallocate(
+            self.resource_group_name, self.vm_name
+        ).result()
+        compute_client.virtual_machines.generalize(self.resource_group_name, self.vm_name)
+
+    def _capture_image_version(self, compute_client):
+        """capture the generalized vm into a managed image and publish it as a gallery version."""
+        vm_result = compute_client.virtual_machines.get(self.resource_group_name, self.vm_name)
+        image_result = compute_client.images.begin_create_or_update(
+            self.resource_group_name,
+            f"onecontainer-image-{self.timestamp}",
+            {"location": self.location, "source_virtual_machine": {"id": vm_result.id}},
+        ).result()
+        logger.debug(
+            f"Publishing image {image_result.name}; this operation might take a few minutes."
+        )
+        version_result = compute_client.gallery_image_versions.begin_create_or_update(
+            self.gallery_resource_group_name,
+            IMAGE_GALLERY,
+            IMAGE_DEFINITION,
+            f"1.0.{self.timestamp}",
+            {"location": self.location, "storage_profile": {"source": {"id": image_result.id}}},
+        ).result()
+        return version_result.id
 
     def _write_deployment_conf(self):
         self.ini_conf[f"AZURE-service-{self.timestamp}"] = {
             "resource": self.resource_group_name,
-            "ssh_ip": f"{self.username}@{self.ip_address}"
+            "ssh_ip": self._ssh_addresses(self.ip_addresses),
         }
+        if self.mode == "scale-set":
+            self.ini_conf[f"AZURE-service-{self.timestamp}"]["scale_set"] = self.scale_set_name
+        if self.shared_network:
+            # informational only, stop never deletes the shared resource group
+            self.ini_conf[f"AZURE-service-{self.timestamp}"][
+                "network_resource"
+            ] = self.network_resource_group_name
         with open(config.CONFIG_FILE, "w") as config_file:
             self.ini_conf.write(config_file)
 
-    def stop(self):
-        """stop running instance and delete resources."""
+    def _ssh_addresses(self, ip_addresses):
+        return ",".join(f"{self.username}@{ip_address}" for ip_address in ip_addresses)
+
+    def scale(self, count: int):
+        """change the instance count of the latest scale set deployment in place."""
         try:
             utils.check_config_exists(config)
+        except Exception as e:
+            logger.error(e)
+            logger.error("Could not get session, please run init command")
+            sys.exit()
+        sections = [
+            section
+            for section in self.ini_conf.sections()
+            if "AZURE-service" in section and self.ini_conf[section].get("scale_set")
+        ]
+        if not sections:
+            logger.error("No scale set deployment found, use start with --backend scale-set")
+            sys.exit(1)
+        deployment = self.ini_conf[sections[-1]]
+        try:
             credential = self._get_stored_session()
-            subscription_client = SubscriptionClient(credential)
-            Azure._get_subscription_id(subscription_client)
-            resource_client = ResourceManagementClient(credential, self.sub_id)
+            self._load_subscription_id(credential)
+            network_client = NetworkManagementClient(credential, self.sub_id)
+            compute_client = ComputeManagementClient(credential, self.sub_id)
+        except Exception as e:
+            logger.error(e)
+            logger.error("Could not get session, please run init command")
+            sys.exit()
+        logger.debug(f"Scaling {deployment['scale_set']} to {count} instances.")
+        poller = compute_client.virtual_machine_scale_sets.begin_update(
+            deployment["resource"], deployment["scale_set"], {"sku": {"capacity": count}}
+        )
+        poller.result()
+        ip_addresses = self._scale_set_ip_addresses(
+            network_client, deployment["resource"], deployment["scale_set"]
+        )
+        deployment["ssh_ip"] = self._ssh_addresses(ip_addresses)
+        with open(config.CONFIG_FILE, "w") as config_file:
+            self.ini_conf.write(config_file)
+        logger.info(f"Scaled {deployment['scale_set']} to {count} instances.")
+
+    def stop(self, no_wait: bool = False):
+        """stop running instance and delete resources.
+
+        With no_wait the deletions are only started and recorded, status checks
+        on them later.
+        """
+        try:
+            utils.check_config_exists(config)
+            resource_client = self._get_resource_client()
             resource_groups = self._get_resource_group_list()
-            self._remove_resource_groups(resource_client, resource_groups)
+            pollers = self._remove_resource_groups(
+                resource_client, resource_groups, wait=not no_wait
+            )
         except:
             logger.error("Could not get session, please run init command")
             sys.exit()
+        if no_wait:
+            self._record_pending_deletions(pollers)
         self._remove_config()
         utils.SSHkeys().delete_ssh_keys()
-        logger.info("Success. All resources have been terminated.")
+        if no_wait:
+            logger.info("Deletion of all resources started, use status to follow it.")
+        else:
+            logger.info("Success. All resources have been terminated.")
+
+    def status(self):
+        """report deployments, resource groups still being deleted and deployment
+        resource groups of the subscription that the config file doesn't know."""
+        tracked = set()
+        for section in self.ini_conf.sections():
+            if "AZURE-service" in section:
+                deployment = dict(self.ini_conf.items(section))
+                tracked.add(deployment.get("resource"))
+                click.echo(f"{deployment.get('resource')}: running, {deployment.get('ssh_ip')}")
+        pending = self._pending_deletions()
+        try:
+            resource_client = self._get_resource_client()
+        except Exception as e:
+            logger.error(e)
+            logger.error("Could not get session, please run init command")
+            sys.exit()
+        for resource_group in iter_resource_groups(resource_client, role="deployment"):
+            if resource_group.name in tracked or resource_group.name in pending:
+                continue
+            click.echo(f"{resource_group.name}: untracked, {resource_group.properties.provisioning_state}")
+        if not pending:
+            return
+        remaining = []
+        for resource_group_name in pending:
+            if resource_client.resource_groups.check_existence(resource_group_name):
+                remaining.append(resource_group_name)
+                click.echo(f"{resource_group_name}: deleting")
+            else:
+                click.echo(f"{resource_group_name}: deleted")
+        self._write_pending_deletions(remaining)
+
+    def _get_resource_client(self):
+        credential = self._get_stored_session()
+        self._load_subscription_id(credential)
+        return ResourceManagementClient(credential, self.sub_id)
 
     def _get_resource_group_list(self):
         resource_groups = []
@@ -365,12 +1086,56 @@ class Azure(Cloud):
         return resource_groups
 
     @staticmethod
-    def _remove_resource_groups(resource_client, resource_groups):
+    def _remove_resource_groups(resource_client, resource_groups, wait: bool = True):
+        """start deleting all resource groups, then await them DELETE_CONCURRENCY
+        at a time when wait is set. Returns the deletion pollers by group name."""
         logger.debug("Terminating resources. This may take a while")
+        pollers = {}
         for resource_group_name in resource_groups:
             logger.debug(f"Terminating {resource_group_name} resource group.")
-            poller = resource_client.resource_groups.begin_delete(resource_group_name)
-            poller.wait()
+            pollers[resource_group_name] = resource_client.resource_groups.begin_delete(
+                resource_group_name
+            )
+        if not wait or not pollers:
+            return pollers
+        with ThreadPoolExecutor(max_workers=DELETE_CONCURRENCY) as pool:
+            futures = {
+                pool.submit(poller.wait): resource_group_name
+                for resource_group_name, poller in pollers.items()
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                future.result()
+                logger.info(
+                    f"Terminated {futures[future]} resource group ({done}/{len(futures)})."
+                )
+        return pollers
+
+    def _pending_deletions(self):
+        if not self.ini_conf.has_section(PENDING_DELETIONS_SECTION):
+            return []
+        names = self.ini_conf[PENDING_DELETIONS_SECTION].get("resource_groups", "")
+        return [name for name in names.split(",") if name]
+
+    def _record_pending_deletions(self, pollers):
+        self._write_pending_deletions(self._pending_deletions() + list(pollers))
+
+    def _write_pending_deletions(self, resource_groups):
+        session = {
+            "SUBSCRIPTION_ID": self._session_setting("SUBSCRIPTION_ID")
+            or getattr(self, "sub_id", None),
+            "CREDENTIAL_TYPE": self._session_setting("CREDENTIAL_TYPE"),
+        }
+        self.ini_conf.remove_section(PENDING_DELETIONS_SECTION)
+        if resource_groups:
+            self.ini_conf[PENDING_DELETIONS_SECTION] = {
+                "resource_groups": ",".join(resource_groups)
+            }
+            for name, value in session.items():
+                if value:
+                    self.ini_conf[PENDING_DELETIONS_SECTION][name] = value
+        if not utils.remove_config_if_empty(self.ini_conf, config):
+            with open(config.CONFIG_FILE, "w") as config_file:
+                self.ini_conf.write(config_file)
 
     def _remove_config(self):
         logger.debug("Removing Azure session from configuration file.")
@@ -0,0 +1,149 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2021 Intel Corporation
+
+"""boot payloads that start the containers of a deployment.
+
+One renderer builds the azure custom data, the gcp container declaration and
+the aws user data. Payloads are rendered once per distinct input, so every
+replica of a deployment reuses the same bytes. cloud-init detects gzip
+compressed user data, compressing it keeps the payloads far below the 64KB
+custom data limit of azure and the 16KB user data limit of aws.
+"""
+import base64
+from functools import lru_cache
+import gzip
+import io
+import json
+import shlex
+from typing import Iterable, Optional, Sequence, Tuple
+
+
+class Container:
+    """a container run on boot: image, environment variables and docker run flags."""
+
+    def __init__(
+        self,
+        image: str,
+        env: Iterable[str] = (),
+        run_flags: Iterable[str] = (),
+        name: Optional[str] = None,
+    ):
+        self.image = image
+        self.env = tuple(env)
+        self.run_flags = tuple(run_flags)
+        self.name = name
+
+    def _key(self) -> tuple:
+        return (self.image, self.env, self.run_flags, self.name)
+
+    def __eq__(self, other):
+        return isinstance(other, Container) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def environment(self) -> Sequence[Tuple[str, str]]:
+        """env entries of the form KEY=VALUE as name and value pairs."""
+        pairs = []
+        for entry in self.env:
+            name, _, value = entry.partition("=")
+            pairs.append((name, value))
+        return pairs
+
+    def run_command(self) -> str:
+        args = ["docker", "run", "-td"]
+        if self.name:
+            args += ["--name", self.name]
+        for entry in self.env:
+            args += ["-e", entry]
+        args += list(self.run_flags)
+        args.append(self.image)
+        return " ".join(shlex.quote(arg) for arg in args)
+
+
+def _runcmd(command: str) -> str:
+    # json strings are valid yaml flow scalars, quotes in the command stay escaped
+    return f"  - [ sh, -c, {json.dumps(command)} ]"
+
+
+@lru_cache(maxsize=32)
+def cloud_config(
+    containers: Tuple[Container, ...] = (),
+    pull_images: Tuple[str, ...] = (),
+    install_docker: bool = True,
+) -> str:
+    """cloud-config that optionally installs docker, pulls images and runs containers."""
+    lines = ["#cloud-config", ""]
+    if install_docker:
+        lines += [
+            "packages:",
+            "  - docker.io",
+            "",
+            "# create the docker group",
+            "groups:",
+            "  - docker",
+            "",
+        ]
+    if containers:
+        lines += [
+            "# Add default auto created user to docker group",
+            "system_info:",
+            "  default_user:",
+            "    groups: [docker]",
+            "",
+        ]
+    commands = [f"docker pull {shlex.quote(image)}" for image in pull_images]
+    commands += [container.run_command() for container in containers]
+    if commands:
+        lines.append("runcmd:")
+        lines += [_runcmd(command) for command in commands]
+    return "\n".join(lines) + "\n"
+
+
+def compressed(payload: str) -> bytes:
+    """gzip payload, with a fixed mtime so the same input gives the same bytes."""
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode="wb", mtime=0) as gzip_file:
+        gzip_file.write(payload.encode())
+    return buffer.getvalue()
+
+
+@lru_cache(maxsize=32)
+def custom_data(
+    containers: Tuple[Container, ...] = (),
+    pull_images: Tuple[str, ...] = (),
+    install_docker: bool = True,
+) -> str:
+    """base64 encoded, compressed cloud-config for azure custom data."""
+    payload = compressed(cloud_config(containers, pull_images, install_docker))
+    return base64.b64encode(payload).decode("latin-1")
+
+
+def user_data_script(*commands: str) -> bytes:
+    """compressed shell script for aws user data, boto3 base64 encodes it."""
+    return compressed("\n".join(("#!/bin/bash",) + commands) + "\n")
+
+
+@lru_cache(maxsize=32)
+def container_declaration(container: Container, name: str) -> str:
+    """gce-container-declaration of a container-optimized os vm.
+
+    Instance metadata is not decompressed, the declaration stays plain yaml.
+    The container-optimized os agent runs a single container and has no
+    equivalent of docker run flags.
+    """
+    lines = [
+        "",
+        "spec:",
+        "  containers:",
+        f"    - image: {json.dumps(container.image)}",
+        f"      name: {json.dumps(name)}",
+        "      stdin: true",
+        "      tty: true",
+    ]
+    if container.env:
+        lines.append("      env:")
+        for env_name, value in container.environment():
+            lines += [f"        - name: {json.dumps(env_name)}", f"          value: {json.dumps(value)}"]
+    lines.append("  restartPolicy: Always")
+    return "\n".join(lines) + "\n"
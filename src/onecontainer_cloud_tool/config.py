@@ -17,5 +17,7 @@ SSH_PATH.mkdir(parents=True, exist_ok=True)
 os.chmod(SSH_PATH, 0o700)
 # config.ini is in ~/.config/occ_config.ini
 CONFIG_FILE = Path(Path.home().resolve() / ".config" / "occ_config.ini")
+# cached discovery results and other local state live in ~/.cache/onecontainer-cloud-tool
+STATE_DIR = Path(Path.home().resolve() / ".cache" / "onecontainer-cloud-tool")
 INSTANCE_LISTING_URL = "https://raw.githubusercontent.com/intel/oneContainer-Cloud-Tool/main/src/onecontainer_cloud_tool/data/instance_listing.json"
 
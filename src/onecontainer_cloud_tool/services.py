@@ -1,18 +1,38 @@
-"""cloud service factory."""
-from typing import Optional
-from onecontainer_cloud_tool.cloud.aws import AWS
-from onecontainer_cloud_tool.cloud.m_azure import Azure
-from onecontainer_cloud_tool.cloud.gcp import GCP
+"""cloud service factory.
+
+Providers are registered by import path so that only the cloud picked on the
+command line pays for importing its SDK.
+"""
+from functools import lru_cache
+import importlib
+from typing import List, Optional, Type
+
 from onecontainer_cloud_tool.cloud.abstract_cloud import Cloud
 
+# cloud name -> (module, class name), imported on first use.
+PROVIDERS = {
+    "aws": ("onecontainer_cloud_tool.cloud.aws", "AWS"),
+    "azure": ("onecontainer_cloud_tool.cloud.m_azure", "Azure"),
+    "gcp": ("onecontainer_cloud_tool.cloud.gcp", "GCP"),
+}
+
+
+def providers() -> List[str]:
+    """names of the registered cloud services."""
+    return list(PROVIDERS)
+
+
+@lru_cache(maxsize=None)
+def provider_class(cloud: str) -> Type[Cloud]:
+    """import and return the provider class registered for cloud."""
+    try:
+        module_name, class_name = PROVIDERS[cloud]
+    except KeyError:
+        raise NotImplementedError(f"unknown cloud service: {cloud}")
+    module = importlib.import_module(module_name)
+    return getattr(module, class_name)
+
 
 def service(cloud="aws") -> Optional[Cloud]:
     """service factory that dispatches to the right cloud service."""
-    if cloud == "aws":
-        return AWS()
-    elif cloud == "azure":
-        return Azure()
-    elif cloud == "gcp":
-        return GCP()
-    else:
-        raise NotImplementedError
+    return provider_class(cloud)()
@@ -0,0 +1,76 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# Copyright (c) 2021 Intel Corporation
+
+"""local state persisted between invocations, with per read expiry."""
+import json
+import os
+from pathlib import Path
+import tempfile
+import threading
+import time
+from typing import Any, Optional
+
+from onecontainer_cloud_tool import config
+from onecontainer_cloud_tool.logger import logger
+
+
+class LocalState:
+    """json file of named values, each stored with the time it was written."""
+
+    def __init__(self, name: str, directory: Optional[Path] = None):
+        self.path = Path(directory or config.STATE_DIR) / f"{name}.json"
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path, "r") as state_file:
+                return json.load(state_file)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            logger.warning(f"ignoring unreadable state file {self.path}")
+            return {}
+
+    def _save(self, data: dict):
+        """write to a temporary file and rename it, readers never see partial state."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix=f".{self.path.name}")
+        try:
+            with os.fdopen(fd, "w") as state_file:
+                json.dump(data, state_file)
+            os.chmod(tmp_path, 0o600)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def get(self, key: str, ttl: Optional[float] = None) -> Any:
+        """value stored under key, None if missing or older than ttl seconds."""
+        with self._lock:
+            entry = self._load().get(key)
+        if entry is None:
+            return None
+        if ttl is not None and time.time() - entry["stored_at"] > ttl:
+            logger.debug(f"{self.path.stem} state for {key} expired")
+            return None
+        return entry["value"]
+
+    def set(self, key: str, value: Any):
+        with self._lock:
+            data = self._load()
+            data[key] = {"value": value, "stored_at": time.time()}
+            self._save(data)
+
+    def delete(self, key: str):
+        with self._lock:
+            data = self._load()
+            if data.pop(key, None) is not None:
+                self._save(data)
+
+    def clear(self):
+        """drop all values."""
+        with self._lock:
+            try:
+                self.path.unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,125 @@
+"""run provisioning steps as a dependency graph on a thread pool."""
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from onecontainer_cloud_tool.logger import logger
+
+
+class Step:
+    """a unit of provisioning work and the steps it requires."""
+
+    def __init__(self, name: str, func: Callable[[], Any], requires: Iterable[str] = ()):
+        self.name = name
+        self.func = func
+        self.requires = tuple(requires)
+        self.result = None
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+
+    @property
+    def duration(self) -> float:
+        if self.started is None or self.finished is None:
+            return 0.0
+        return self.finished - self.started
+
+    def run(self):
+        self.started = time.monotonic()
+        try:
+            self.result = self.func()
+        finally:
+            self.finished = time.monotonic()
+        return self.result
+
+
+class StepGraph:
+    """execute steps concurrently, each one as soon as its requirements are done.
+
+    The first failing step stops any further scheduling, running steps are
+    allowed to finish and the error is raised to the caller.
+    """
+
+    def __init__(self, steps: Iterable[Step], max_workers: int = 4):
+        self.steps: Dict[str, Step] = {}
+        for step in steps:
+            if step.name in self.steps:
+                raise ValueError(f"duplicate step {step.name}")
+            self.steps[step.name] = step
+        self.max_workers = max_workers
+        self._validate()
+
+    def _validate(self):
+        """reject unknown requirements and cycles before anything runs."""
+        for step in self.steps.values():
+            for required in step.requires:
+                if required not in self.steps:
+                    raise ValueError(f"step {step.name} requires unknown step {required}")
+        visiting, visited = set(), set()
+
+        def visit(name):
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError(f"dependency cycle through step {name}")
+            visiting.add(name)
+            for required in self.steps[name].requires:
+                visit(required)
+            visiting.discard(name)
+            visited.add(name)
+
+        for name in self.steps:
+            visit(name)
+
+    def run(self) -> Dict[str, Any]:
+        """run all steps and return their results by step name."""
+        pending = dict(self.steps)
+        done = set()
+        running = {}
+        error = None
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while pending or running:
+                if error is None:
+                    for name, step in list(pending.items()):
+                        if all(required in done for required in step.requires):
+                            logger.debug(f"starting step {name}")
+                            running[pool.submit(step.run)] = step
+                            del pending[name]
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    step = running.pop(future)
+                    exc = future.exception()
+                    if exc is not None:
+                        logger.debug(f"step {step.name} failed: {exc}")
+                        error = error or exc
+                    else:
+                        logger.debug(f"step {step.name} done in {step.duration:.1f}s")
+                        done.add(step.name)
+        if error is not None:
+            raise error
+        return {name: step.result for name, step in self.steps.items()}
+
+    def critical_path(self) -> List[Step]:
+        """chain of finished steps that determined the total run time."""
+        finished = [step for step in self.steps.values() if step.finished is not None]
+        if not finished:
+            return []
+        path = [max(finished, key=lambda step: step.finished)]
+        while path[-1].requires:
+            path.append(
+                max(
+                    (self.steps[name] for name in path[-1].requires),
+                    key=lambda step: step.finished or 0.0,
+                )
+            )
+        return list(reversed(path))
+
+    def log_critical_path(self):
+        path = self.critical_path()
+        if path:
+            total = path[-1].finished - min(
+                step.started for step in self.steps.values() if step.started is not None
+            )
+            chain = " -> ".join(f"{step.name} ({step.duration:.1f}s)" for step in path)
+            logger.info(f"critical path ({total:.1f}s): {chain}")
@@ -3,9 +3,11 @@
 import datetime
 import math
 from pathlib import Path
+import random
 import uuid
 import os
 import sys
+import time
 
 from Cryptodome.PublicKey import RSA
 
@@ -17,6 +19,32 @@ def timestamp():
     return math.floor(datetime.datetime.now().timestamp())
 
 
+def backoff_delays(initial=1.0, factor=2.0, maximum=30.0, jitter=0.0):
+    """yield sleep intervals growing by factor up to maximum.
+
+    jitter is the fraction of each interval that is randomly shaved off, so
+    concurrent pollers don't hit the api at the same time.
+    """
+    delay = initial
+    while True:
+        yield delay * (1 - jitter * random.random())
+        delay = min(delay * factor, maximum)
+
+
+def retry(func, should_retry, attempts=8, initial=1.0, factor=2.0, maximum=30.0):
+    """call func, retrying with backoff while should_retry(error) is true."""
+    delays = backoff_delays(initial, factor, maximum, jitter=0.2)
+    for attempt in range(1, attempts + 1):
+        try:
+            return func()
+        except Exception as err:
+            if attempt == attempts or not should_retry(err):
+                raise
+            delay = next(delays)
+            logger.debug(f"attempt {attempt} failed: {err}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
 def uuid_str():
     """get a uuid string."""
     str(uuid.uuid4())
@@ -38,3 +38,467 @@ def test_aws_stop():
     aws = service("aws")
     aws.stop()
     assert not os.path.isfile(config.CONFIG_FILE)
+
+
+class FakeWaiter:
+    def __init__(self, calls):
+        self.calls = calls
+
+    def wait(self, **kwargs):
+        self.calls.append(("wait", kwargs))
+
+
+class FakeEC2:
+    def __init__(self):
+        self.calls = []
+
+    def run_instances(self, **kwargs):
+        self.calls.append(("run_instances", kwargs))
+        return {"Instances": [{"InstanceId": f"i-{n}"} for n in range(kwargs["MaxCount"])]}
+
+    def get_waiter(self, name):
+        return FakeWaiter(self.calls)
+
+    def describe_instances(self, InstanceIds):
+        return {
+            "Reservations": [
+                {
+                    "Instances": [
+                        {
+                            "InstanceId": instance_id,
+                            "PublicDnsName": f"{instance_id}.example.com",
+                            "PublicIpAddress": "10.0.0.1",
+                        }
+                        for instance_id in InstanceIds
+                    ]
+                }
+            ]
+        }
+
+
+class FakeECS:
+    def __init__(self, registrations):
+        self.registrations = list(registrations)
+        self.described = []
+
+    def get_paginator(self, name):
+        assert name == "list_container_instances"
+        ecs = self
+
+        class Paginator:
+            def paginate(self, cluster, status=None):
+                registered = ecs.registrations.pop(0)
+                arns = [f"arn-{n}" for n in range(registered)]
+                return [
+                    {"containerInstanceArns": arns[start : start + 100]}
+                    for start in range(0, max(registered, 1), 100)
+                ]
+
+        return Paginator()
+
+    def describe_container_instances(self, cluster, containerInstances):
+        self.described.append(len(containerInstances))
+        return {
+            "containerInstances": [
+                {"ec2InstanceId": arn.replace("arn", "i")} for arn in containerInstances
+            ]
+        }
+
+
+def test_aws_fleet_single_run_instances():
+    aws = service("aws")
+    aws.ini_conf["AWS"] = {"PRIVATE_KEY_FILE": "onecontainer-1.pem"}
+    aws.cluster_name = "onecontainer-cluster-1"
+    aws.security_group_id = "sg-1"
+    ec2 = FakeEC2()
+    ecs = FakeECS([3])
+    instances = aws._create_ec2_instances(ec2, ecs, "m5n.large", "ami-1", count=3)
+    assert [call[0] for call in ec2.calls] == ["run_instances", "wait"]
+    assert ec2.calls[0][1]["MinCount"] == ec2.calls[0][1]["MaxCount"] == 3
+    assert ec2.calls[1][1]["InstanceIds"] == ["i-0", "i-1", "i-2"]
+    assert [instance["dns"] for instance in instances] == [
+        "i-0.example.com",
+        "i-1.example.com",
+        "i-2.example.com",
+    ]
+
+
+def test_aws_ecs_readiness_polls_registration():
+    aws = service("aws")
+    aws.cluster_name = "onecontainer-cluster-1"
+    ec2 = FakeEC2()
+    ecs = FakeECS([0, 1, 2])
+    timings = aws._wait_until_ready(
+        ec2, ecs, ["i-0", "i-1"], readiness="ecs", poll_interval=0.01
+    )
+    assert set(timings) == {"instance_running", "ecs_registration"}
+    assert ecs.registrations == []
+
+
+def test_aws_container_instances_listed_past_one_page():
+    from onecontainer_cloud_tool.cloud.aws import AWS
+
+    aws = service("aws")
+    aws.cluster_name = "onecontainer-cluster-1"
+    aws._wait_for_container_instances(FakeECS([250]), 250)
+    ecs = FakeECS([250])
+    instance_ids = AWS._list_ec2_instances(ecs, "onecontainer-cluster-1")
+    assert len(instance_ids) == 250 and instance_ids[-1] == "i-249"
+    assert ecs.described == [100, 100, 50]
+
+
+class FakeTaskDefinitionECS:
+    def __init__(self, arns):
+        self.arns = arns
+        self.deregistered = []
+        self.deleted = []
+
+    def get_paginator(self, name):
+        arns = self.arns
+
+        class Paginator:
+            def paginate(self, **kwargs):
+                return [{"taskDefinitionArns": arns[:15]}, {"taskDefinitionArns": arns[15:]}]
+
+        return Paginator()
+
+    def deregister_task_definition(self, taskDefinition):
+        self.deregistered.append(taskDefinition)
+
+    def delete_task_definitions(self, taskDefinitions):
+        self.deleted.append(taskDefinitions)
+
+
+def test_aws_deregister_tasks_in_batches():
+    from onecontainer_cloud_tool.cloud.aws import AWS
+
+    arns = [f"arn:task:{n}" for n in range(23)]
+    ecs = FakeTaskDefinitionECS(arns)
+    AWS._deregister_tasks(ecs, "onecontainer-task-1")
+    assert sorted(ecs.deregistered) == sorted(arns)
+    assert [len(batch) for batch in ecs.deleted] == [10, 10, 3]
+
+
+def test_aws_session_pool_reuses_and_invalidates():
+    from onecontainer_cloud_tool.cloud import aws_session
+
+    ec2 = aws_session.get_client("ec2", "us-east-1", access_key="a", secret_key="b")
+    assert aws_session.get_client("ec2", "us-east-1", access_key="a", secret_key="b") is ec2
+    assert aws_session.get_client("ec2", "us-west-2", access_key="a", secret_key="b") is not ec2
+    assert ec2.meta.config.max_pool_connections == aws_session.CLIENT_SETTINGS["MAX_POOL_CONNECTIONS"]
+    assert ec2.meta.config.retries["mode"] == "adaptive"
+    aws_session.invalidate()
+    assert aws_session.get_client("ec2", "us-east-1", access_key="a", secret_key="b") is not ec2
+
+
+def test_aws_client_config_warns_once_without_tcp_keepalive(monkeypatch):
+    from onecontainer_cloud_tool.cloud import aws_session
+
+    def config_without_keepalive(tcp_keepalive=None, **settings):
+        if tcp_keepalive is not None:
+            raise TypeError("Got unexpected keyword argument 'tcp_keepalive'")
+        return settings
+
+    warnings = []
+    monkeypatch.setattr(aws_session, "Config", config_without_keepalive)
+    monkeypatch.setattr(aws_session, "_keepalive_warned", False)
+    monkeypatch.setattr(aws_session.logger, "warning", warnings.append)
+    assert aws_session.client_config()["max_pool_connections"] == 32
+    aws_session.client_config()
+    assert len(warnings) == 1 and "tcp keepalive" in warnings[0]
+
+
+def test_aws_session_settings_accept_fractional_timeouts():
+    from onecontainer_cloud_tool.cloud import aws_session
+
+    settings = aws_session.settings_from_config(
+        {"REGION": "us-east-1", "CONNECT_TIMEOUT": "2.5", "MAX_ATTEMPTS": "3"}
+    )
+    assert settings["connect_timeout"] == 2.5
+    assert settings["read_timeout"] == 60.0
+    assert settings["max_attempts"] == 3
+
+
+def test_aws_discovery_key_hides_the_access_key(monkeypatch):
+    from onecontainer_cloud_tool.cloud.aws import AWS
+
+    ini_conf = configparser.ConfigParser()
+    ini_conf["AWS"] = {"REGION": "us-east-1", "ACCESS_KEY": "AKIAEXAMPLE"}
+    monkeypatch.setattr(AWS, "ini_conf", ini_conf, raising=False)
+    key = AWS._discovery_key()
+    assert key.startswith("us-east-1:") and "AKIAEXAMPLE" not in key
+    ini_conf["AWS"]["ACCESS_KEY"] = "AKIAOTHER"
+    assert AWS._discovery_key() != key
+
+
+def test_aws_default_vpc_creation_failure_propagates(monkeypatch):
+    from botocore.exceptions import ClientError
+
+    from onecontainer_cloud_tool.cloud import aws as aws_module
+
+    class NoDefaultVpcEC2:
+        def describe_vpcs(self, Filters):
+            return {"Vpcs": []}
+
+        def create_default_vpc(self):
+            raise ClientError({"Error": {"Code": "UnauthorizedOperation"}}, "CreateDefaultVpc")
+
+    ini_conf = configparser.ConfigParser()
+    ini_conf["AWS"] = {"REGION": "us-east-1"}
+    monkeypatch.setattr(aws_module.AWS, "ini_conf", ini_conf, raising=False)
+    monkeypatch.setattr(
+        aws_module.AWS, "_get_client", classmethod(lambda cls, name: NoDefaultVpcEC2())
+    )
+    aws = service("aws")
+    with pytest.raises(ClientError):
+        aws._discover_network(refresh=True)
+
+
+class FakeSecurityGroupEC2:
+    def __init__(self, groups, interfaces=()):
+        self.groups = groups
+        self.interfaces = list(interfaces)
+        self.deleted = []
+
+    def describe_security_groups(self, Filters=None, GroupIds=None):
+        return {"SecurityGroups": self.groups}
+
+    def get_paginator(self, name):
+        assert name == "describe_network_interfaces"
+        interfaces = self.interfaces
+
+        class Paginator:
+            def paginate(self, Filters):
+                return [{"NetworkInterfaces": interfaces}]
+
+        return Paginator()
+
+    def delete_security_group(self, GroupId):
+        self.deleted.append(GroupId)
+
+
+def test_aws_security_group_reused_by_ruleset(monkeypatch):
+    from onecontainer_cloud_tool.cloud import aws as aws_module
+
+    ruleset = aws_module.ruleset_hash(
+        aws_module.SECURITY_GROUP_INGRESS, aws_module.SECURITY_GROUP_EGRESS
+    )
+    group = {"GroupId": "sg-shared", "Tags": [{"Key": aws_module.RULESET_TAG, "Value": ruleset}]}
+    ec2 = FakeSecurityGroupEC2([group])
+    monkeypatch.setattr(aws_module.AWS, "_get_clients", classmethod(lambda cls: (ec2, None)))
+    aws = service("aws")
+    aws.vpc_id = "vpc-1"
+    assert aws._config_security_group() == "sg-shared"
+
+
+def test_aws_security_group_released_by_actual_use():
+    from onecontainer_cloud_tool.cloud.aws import AWS
+
+    ec2 = FakeSecurityGroupEC2(
+        [], [{"Attachment": {"InstanceId": "i-stopped"}}, {"Attachment": {"InstanceId": "i-other"}}]
+    )
+    # another deployment's instance still uses the group
+    assert not AWS._release_security_group(ec2, "sg-shared", ["i-stopped"])
+    assert ec2.deleted == []
+    # interfaces of the terminated instances don't keep it
+    ec2.interfaces.pop()
+    assert AWS._release_security_group(ec2, "sg-shared", ["i-stopped"])
+    assert ec2.deleted == ["sg-shared"]
+
+
+def test_aws_failed_deploy_releases_its_security_group(monkeypatch):
+    from onecontainer_cloud_tool.cloud import aws as aws_module
+
+    ec2 = FakeSecurityGroupEC2([])
+
+    def failing_steps(self, *args):
+        def security_group():
+            self.security_group_id = "sg-new"
+
+        def instances():
+            raise RuntimeError("insufficient capacity")
+
+        return [
+            aws_module.Step("security_group", security_group),
+            aws_module.Step("instances", instances, requires=["security_group"]),
+        ]
+
+    monkeypatch.setattr(aws_module.AWS, "_check_config_file", classmethod(lambda cls: None))
+    monkeypatch.setattr(aws_module.AWS, "_get_clients", classmethod(lambda cls: (ec2, None)))
+    monkeypatch.setattr(aws_module.AWS, "_get_client", classmethod(lambda cls, name: ec2))
+    monkeypatch.setattr(aws_module.AWS, "_deploy_steps", failing_steps)
+    service("aws").deploy("m5n.large", "redis", "ami-1")
+    assert ec2.deleted == ["sg-new"]
+
+
+def test_aws_stop_skips_deleted_security_group(monkeypatch):
+    from botocore.exceptions import ClientError
+
+    from onecontainer_cloud_tool.cloud import aws as aws_module
+
+    class DeletedGroupEC2(FakeSecurityGroupEC2):
+        def delete_security_group(self, GroupId):
+            raise ClientError(
+                {"Error": {"Code": "InvalidGroup.NotFound"}}, "DeleteSecurityGroup"
+            )
+
+    class ClusterECS:
+        def __init__(self):
+            self.deleted = []
+
+        def delete_cluster(self, cluster):
+            self.deleted.append(cluster)
+
+    ecs = ClusterECS()
+    monkeypatch.setattr(
+        aws_module.AWS, "_get_clients", classmethod(lambda cls: (DeletedGroupEC2([]), ecs))
+    )
+    aws_module.AWS._terminate_cluster_instances([], [("onecontainer-cluster-1", "sg-gone")])
+    assert ecs.deleted == ["onecontainer-cluster-1"]
+
+
+@pytest.mark.parametrize(
+    "failing_service, failing_cluster, kept",
+    [
+        (None, None, []),
+        ("cluster-broken", None, ["AWS-service-broken"]),
+        ("cluster-broken", "cluster-ok", ["AWS-service-ok", "AWS-service-broken"]),
+    ],
+)
+def test_aws_stop_keeps_deployments_whose_teardown_failed(
+    tmp_path, monkeypatch, failing_service, failing_cluster, kept
+):
+    from onecontainer_cloud_tool.cloud import aws as aws_module
+
+    config_file = tmp_path / "occ_config.ini"
+    key_file = tmp_path / "onecontainer-1.pem"
+    config_file.write_text("")
+    key_file.write_text("")
+    monkeypatch.setattr(config, "CONFIG_FILE", str(config_file))
+
+    def delete_service(cluster_name, service_name, task_name, deregister_tasks=True):
+        if cluster_name == failing_service:
+            raise RuntimeError("service stuck")
+        return ["i-1"]
+
+    terminated = []
+
+    def terminate(instance_ids, clusters_info, pool=None):
+        terminated.append((instance_ids, [cluster for cluster, _ in clusters_info]))
+        if failing_cluster:
+            return [([failing_cluster], RuntimeError("cluster still has instances"))]
+        return []
+
+    removed_key_pairs = []
+    errors = []
+    monkeypatch.setattr(aws_module.AWS, "_delete_service", staticmethod(delete_service))
+    monkeypatch.setattr(aws_module.AWS, "_remove_key_pair", staticmethod(removed_key_pairs.append))
+    monkeypatch.setattr(aws_module.AWS, "_terminate_cluster_instances", staticmethod(terminate))
+    monkeypatch.setattr(aws_module.logger, "error", errors.append)
+    aws = service("aws")
+    aws.ini_conf["AWS"] = {
+        "PRIVATE_KEY_FILE": "onecontainer-1.pem",
+        "PRIVATE_KEY_FILE_PATH": str(key_file),
+    }
+    for name in ("ok", "broken"):
+        aws.ini_conf[f"AWS-service-{name}"] = {
+            "cluster_name": f"cluster-{name}",
+            "service_name": f"service-{name}",
+            "task_name": f"task-{name}",
+            "task_hash": "1",
+            "security_group_id": "sg-1",
+            "instance_ids": f"i-{name}",
+        }
+    aws.stop()
+    assert terminated == [(["i-1", "i-ok", "i-broken"], ["cluster-ok", "cluster-broken"])]
+    if not kept:
+        assert not config_file.exists() and not key_file.exists()
+        assert removed_key_pairs == ["onecontainer-1"] and errors == []
+        return
+    # the key and session stay so stop can run again on what is left
+    assert key_file.exists() and removed_key_pairs == []
+    ini_conf = configparser.ConfigParser()
+    ini_conf.read(config_file)
+    assert ini_conf.sections() == ["AWS"] + kept
+    assert "service stuck" in errors[0]
+
+
+def test_aws_stale_instance_ids_skipped_on_terminate(monkeypatch):
+    from onecontainer_cloud_tool.cloud import aws as aws_module
+
+    class TerminatingEC2(FakeEC2):
+        def get_paginator(self, name):
+            assert name == "describe_instances"
+
+            class Paginator:
+                def paginate(self, Filters):
+                    ids = [value for value in Filters[0]["Values"] if value != "i-purged"]
+                    return [{"Reservations": [{"Instances": [{"InstanceId": i} for i in ids]}]}]
+
+            return Paginator()
+
+        def terminate_instances(self, DryRun, InstanceIds):
+            self.calls.append(("terminate_instances", InstanceIds))
+
+    class ClusterECS:
+        def delete_cluster(self, cluster):
+            pass
+
+    ec2 = TerminatingEC2()
+    monkeypatch.setattr(
+        aws_module.AWS, "_get_clients", classmethod(lambda cls: (ec2, ClusterECS()))
+    )
+    monkeypatch.setattr(
+        aws_module.AWS, "_release_security_group", staticmethod(lambda *args: False)
+    )
+    errors = aws_module.AWS._terminate_cluster_instances(
+        ["i-1", "i-purged"], [("onecontainer-cluster-1", "sg-1")]
+    )
+    assert errors == []
+    assert ec2.calls[0] == ("terminate_instances", ["i-1"])
+
+
+@pytest.mark.parametrize(
+    "instance_type, architecture",
+    [
+        ("m5n.large", "x86_64"),
+        ("g4dn.xlarge", "x86_64"),
+        ("m6g.large", "arm64"),
+        ("c6gn.medium", "arm64"),
+        ("a1.large", "arm64"),
+    ],
+)
+def test_aws_instance_architecture(instance_type, architecture):
+    from onecontainer_cloud_tool.cloud.aws import instance_architecture
+
+    assert instance_architecture(instance_type) == architecture
+
+
+class FakeTaskECS:
+    def __init__(self):
+        self.registered = {}
+
+    def describe_task_definition(self, taskDefinition):
+        from botocore.exceptions import ClientError
+
+        if taskDefinition not in self.registered:
+            raise ClientError(
+                {"Error": {"Code": "ClientException"}}, "DescribeTaskDefinition"
+            )
+        return {"taskDefinition": {"status": "ACTIVE"}}
+
+    def register_task_definition(self, family, **kwargs):
+        self.registered[family] = self.registered.get(family, 0) + 1
+
+
+def test_aws_task_definition_reused_by_content():
+    aws = service("aws")
+    ecs = FakeTaskECS()
+    aws._register_container_task(ecs, "sysstacks/dlrs-tensorflow2-ubuntu")
+    first = aws.task_name
+    aws._register_container_task(ecs, "sysstacks/dlrs-tensorflow2-ubuntu")
+    assert aws.task_name == first
+    assert ecs.registered == {first: 1}
+    aws._register_container_task(ecs, "sysstacks/dlrs-pytorch-ubuntu")
+    assert aws.task_name != first
+    assert len(ecs.registered) == 2
@@ -40,3 +40,428 @@ def test_azure_stop():
         azure.stop()
         assert not os.path.isfile(config.CONFIG_FILE)
         assert pytest_wrapped_e.value == 1
+
+
+class FakeResult:
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.id = f"/ids/{name}"
+        self.location = "eastus"
+        self.ip_address = "20.0.0.1"
+        self.address_prefix = "10.0.0.0/24"
+        self.address_space = FakeResult.Space()
+        self.__dict__.update(attrs)
+
+    class Space:
+        address_prefixes = ["10.0.0.0/16"]
+
+
+class FakePoller:
+    def __init__(self, result):
+        self._result = result
+
+    def result(self):
+        return self._result
+
+
+class FakeOperations:
+    def __init__(self, calls):
+        self.calls = calls
+
+    def begin_create_or_update(self, *args):
+        self.calls.append((args[-2], args[-1]))
+        return FakePoller(FakeResult(args[-2]))
+
+
+class FakeNetworkClient:
+    def __init__(self):
+        self.calls = []
+        operations = FakeOperations(self.calls)
+        self.virtual_networks = operations
+        self.subnets = operations
+        self.public_ip_addresses = operations
+        self.network_security_groups = operations
+        self.network_interfaces = operations
+
+
+class FakeComputeClient:
+    def __init__(self, calls):
+        self.virtual_machine_scale_sets = FakeOperations(calls)
+        self.virtual_machines = FakeOperations(calls)
+
+
+class FakeKeys:
+    public_key = "ssh-rsa AAAA"
+
+
+@pytest.fixture
+def azure(monkeypatch):
+    """azure provider in eastus with generated resource names and fake ssh keys."""
+    from onecontainer_cloud_tool import utils
+
+    monkeypatch.setattr(utils, "SSHkeys", FakeKeys)
+    azure = service("azure")
+    azure.ini_conf["AZURE"] = {"REGION": "eastus"}
+    azure._generate_resources_names()
+    return azure
+
+
+def test_azure_network_steps_wire_dependencies(azure):
+    from onecontainer_cloud_tool.step_graph import StepGraph
+
+    network_client = FakeNetworkClient()
+    steps = [
+        step
+        for step in azure._deploy_steps(network_client, None, None, None, None)
+        if step.name != "vm"
+    ]
+    StepGraph(steps).run()
+    nic_body = dict(network_client.calls)[azure.nic_name]
+    assert nic_body["ip_configurations"][0]["subnet"] == {"id": f"/ids/{azure.subnet_name}"}
+    assert nic_body["network_security_group"] == {"id": f"/ids/{azure.nsg_name}"}
+
+
+def test_azure_shared_network_is_reused(azure):
+    from onecontainer_cloud_tool.step_graph import StepGraph
+
+    class ExistingOperations(FakeOperations):
+        def get(self, *args):
+            return FakeResult(args[-1])
+
+    azure._use_shared_network()
+    network_client = FakeNetworkClient()
+    operations = ExistingOperations(network_client.calls)
+    network_client.subnets = operations
+    network_client.network_security_groups = operations
+    steps = [
+        step
+        for step in azure._deploy_steps(network_client, None, None, None, None)
+        if step.name != "vm"
+    ]
+    StepGraph(steps).run()
+    assert azure.network_resource_group_name == "onecontainer-shared-eastus"
+    assert [name for name, _ in network_client.calls] == [azure.ip_name, azure.nic_name]
+    nic_body = dict(network_client.calls)[azure.nic_name]
+    assert nic_body["network_security_group"] == {"id": f"/ids/{azure.nsg_name}"}
+
+
+@pytest.mark.parametrize("vnet_exists", [False, True])
+def test_azure_shared_network_creates_only_missing_resources(azure, vnet_exists):
+    from azure.core.exceptions import ResourceNotFoundError
+
+    from onecontainer_cloud_tool.step_graph import StepGraph
+
+    class MissingOperations(FakeOperations):
+        def get(self, *args):
+            raise ResourceNotFoundError("not found")
+
+    class ExistingOperations(FakeOperations):
+        def get(self, *args):
+            return FakeResult(args[-1])
+
+    azure._use_shared_network()
+    network_client = FakeNetworkClient()
+    network_client.subnets = MissingOperations(network_client.calls)
+    network_client.network_security_groups = ExistingOperations(network_client.calls)
+    network_client.virtual_networks = (
+        ExistingOperations if vnet_exists else MissingOperations
+    )(network_client.calls)
+    StepGraph(azure._shared_network_steps(network_client)).run()
+    created = [name for name, _ in network_client.calls]
+    if vnet_exists:
+        assert created == [azure.subnet_name]
+    else:
+        assert created == [azure.vnet_name, azure.subnet_name]
+
+
+def test_azure_scale_set_built_from_vm_profiles(azure):
+    from types import SimpleNamespace
+
+    from onecontainer_cloud_tool.cloud.m_azure import SCALE_SET_API_VERSION
+    from onecontainer_cloud_tool.step_graph import StepGraph
+
+    network_client = FakeNetworkClient()
+    resource_client = SimpleNamespace(deployments=FakeOperations(network_client.calls))
+    steps = azure._scale_set_steps(
+        network_client,
+        resource_client,
+        "UbuntuServer",
+        "Standard_F2s_v2",
+        "Y3VzdG9t",
+        32,
+    )
+    StepGraph(steps).run()
+    template = dict(network_client.calls)[f"onecontainer-scale-set-{azure.timestamp}"]
+    [scale_set] = template["properties"]["template"]["resources"]
+    assert scale_set["name"] == azure.scale_set_name
+    assert scale_set["apiVersion"] == SCALE_SET_API_VERSION
+    assert scale_set["sku"]["capacity"] == 32
+    profile = scale_set["properties"]["virtualMachineProfile"]
+    assert profile["osProfile"]["computerNamePrefix"] == azure.vm_name
+    assert profile["osProfile"]["customData"] == "Y3VzdG9t"
+    nic = profile["networkProfile"]["networkInterfaceConfigurations"][0]
+    ip_configuration = nic["ipConfigurations"][0]
+    assert ip_configuration["subnet"] == {"id": f"/ids/{azure.subnet_name}"}
+    # standard public ips, like the vm and arm-template backends
+    assert ip_configuration["publicIPAddressConfiguration"]["sku"]["name"] == "Standard"
+    assert nic["networkSecurityGroup"] == {"id": f"/ids/{azure.nsg_name}"}
+
+
+def test_azure_arm_template_contains_deployment(azure):
+    template = azure._arm_template("UbuntuServer", "Standard_F2s_v2", "Y3VzdG9t")
+    resources = {resource["name"]: resource for resource in template["resources"]}
+    assert set(resources) == {
+        azure.vnet_name,
+        f"{azure.vnet_name}/{azure.subnet_name}",
+        azure.ip_name,
+        azure.nsg_name,
+        azure.nic_name,
+        azure.vm_name,
+    }
+    vm = resources[azure.vm_name]
+    assert vm["dependsOn"] == [vm["properties"]["networkProfile"]["networkInterfaces"][0]["id"]]
+    assert vm["properties"]["osProfile"]["customData"] == "Y3VzdG9t"
+    assert len(resources[azure.nic_name]["dependsOn"]) == 3
+
+
+def test_azure_resource_groups_deleted_concurrently():
+    import threading
+
+    from onecontainer_cloud_tool.cloud.m_azure import Azure
+
+    started = []
+    barrier = threading.Barrier(3, timeout=5)
+
+    class DeletePoller:
+        def wait(self):
+            barrier.wait()
+
+    class ResourceGroups:
+        def begin_delete(self, name):
+            started.append(name)
+            return DeletePoller()
+
+    class ResourceClient:
+        resource_groups = ResourceGroups()
+
+    groups = ["rg-1", "rg-2", "rg-3"]
+    pollers = Azure._remove_resource_groups(ResourceClient(), groups)
+    assert started == groups
+    assert list(pollers) == groups
+    assert Azure._remove_resource_groups(ResourceClient(), ["rg-4"], wait=False)
+
+
+def test_azure_token_cache_reused_until_expiry(tmp_path, monkeypatch):
+    import time
+
+    from azure.core.credentials import AccessToken
+
+    from onecontainer_cloud_tool.cloud import azure_auth
+    from onecontainer_cloud_tool.state import LocalState
+
+    monkeypatch.setattr(azure_auth, "token_state", LocalState("tokens", directory=tmp_path))
+    calls = []
+
+    class FakeCredential:
+        def get_token(self, *scopes, **kwargs):
+            calls.append(scopes)
+            return AccessToken(f"token-{len(calls)}", int(time.time()) + 3600)
+
+    credential = azure_auth.CachedTokenCredential("AzureCliCredential")
+    credential._credential = FakeCredential()
+    assert credential.get_token("https://management.azure.com/.default").token == "token-1"
+    fresh = azure_auth.CachedTokenCredential("AzureCliCredential")
+    assert fresh.get_token("https://management.azure.com/.default").token == "token-1"
+    assert fresh._credential is None
+    assert len(calls) == 1
+    assert credential.successful_credential_type == "FakeCredential"
+
+
+def test_azure_instance_type_checked_against_cache(tmp_path, monkeypatch):
+    from onecontainer_cloud_tool.cloud import m_azure
+    from onecontainer_cloud_tool.state import LocalState
+
+    monkeypatch.setattr(m_azure, "metadata_state", LocalState("metadata", directory=tmp_path))
+    listed = []
+
+    class Size:
+        def __init__(self, name):
+            self.name = name
+
+    class VirtualMachineSizes:
+        def list(self, location):
+            listed.append(location)
+            return [Size("Standard_F2s_v2"), Size("Standard_D2s_v3")]
+
+    class ComputeClient:
+        virtual_machine_sizes = VirtualMachineSizes()
+
+    azure = service("azure")
+    azure.ini_conf["AZURE"] = {"REGION": "eastus"}
+    azure.sub_id = "sub-1"
+    azure._validate_instance_type(ComputeClient(), "Standard_F2s_v2")
+    azure._validate_instance_type(ComputeClient(), "Standard_D2s_v3")
+    assert listed == ["eastus"]
+    with pytest.raises(ValueError):
+        azure._validate_instance_type(ComputeClient(), "m5n.large")
+    assert listed == ["eastus", "eastus"]
+
+
+@pytest.mark.parametrize("baked", [False, True])
+def test_azure_deploy_with_and_without_baked_image(azure, tmp_path, monkeypatch, baked):
+    import base64
+    import gzip
+
+    from onecontainer_cloud_tool import utils
+    from onecontainer_cloud_tool.cloud import m_azure
+    from onecontainer_cloud_tool.state import LocalState
+
+    network_client = FakeNetworkClient()
+    compute_client = FakeComputeClient(network_client.calls)
+    monkeypatch.setattr(m_azure, "ResourceManagementClient", lambda *args: None)
+    monkeypatch.setattr(m_azure, "NetworkManagementClient", lambda *args: network_client)
+    monkeypatch.setattr(m_azure, "ComputeManagementClient", lambda *args: compute_client)
+    monkeypatch.setattr(m_azure, "image_state", LocalState("images", directory=tmp_path))
+    monkeypatch.setattr(utils, "check_config_exists", lambda config: None)
+    monkeypatch.setattr(azure, "_get_stored_session", lambda: None)
+    monkeypatch.setattr(azure, "_load_subscription_id", lambda credential: None)
+    monkeypatch.setattr(azure, "_validate_instance_type", lambda *args: None)
+    monkeypatch.setattr(azure, "_create_resource_group", lambda *args, **kwargs: None)
+    monkeypatch.setattr(azure, "_write_deployment_conf", lambda: None)
+    azure.sub_id = "sub"
+    image_id = "/galleries/onecontainer_gallery/images/onecontainer-docker/versions/1.0.1"
+    if baked:
+        m_azure.image_state.set(azure._image_key(), {"id": image_id, "images": ["redis"]})
+
+    azure.deploy("Standard_F2s_v2", "redis")
+
+    body = dict(network_client.calls)[azure.vm_name]
+    image_reference = body["storage_profile"]["image_reference"]
+    custom_data = gzip.decompress(base64.b64decode(body["os_profile"]["custom_data"])).decode()
+    assert "docker run -td redis" in custom_data
+    if baked:
+        assert image_reference == {"id": image_id}
+        assert "docker.io" not in custom_data
+    else:
+        assert image_reference["offer"] == "UbuntuServer"
+        assert "docker.io" in custom_data
+    assert azure.ip_addresses == ["20.0.0.1"]
+
+
+class FakePaged:
+    def __init__(self, pages):
+        self.pages = pages
+        self.fetched = 0
+
+    def by_page(self):
+        for page in self.pages:
+            self.fetched += 1
+            yield iter(page)
+
+
+def test_azure_subscriptions_streamed_until_match():
+    from types import SimpleNamespace
+
+    from onecontainer_cloud_tool.cloud.m_azure import Azure
+
+    def sub(number, state="Enabled"):
+        return SimpleNamespace(
+            subscription_id=f"id-{number}", display_name=f"team-{number}", state=state
+        )
+
+    paged = FakePaged([[sub(0, "Disabled"), sub(1)], [sub(2), sub(3)], [sub(4)]])
+    client = SimpleNamespace(subscriptions=SimpleNamespace(list=lambda: paged))
+    try:
+        Azure._get_subscription_id(client, "team-2")
+        assert Azure.sub_id == "id-2"
+        assert paged.fetched == 2
+        paged.fetched = 0
+        Azure._get_subscription_id(client)
+        assert Azure.sub_id == "id-1"
+        assert paged.fetched == 1
+        with pytest.raises(ValueError):
+            Azure._get_subscription_id(client, "team-0")
+    finally:
+        del Azure.sub_id
+
+
+def test_azure_resource_groups_filtered_by_tag():
+    from types import SimpleNamespace
+
+    from onecontainer_cloud_tool.cloud.m_azure import MANAGED_TAG, iter_resource_groups
+
+    filters = []
+
+    def list_groups(filter):
+        filters.append(filter)
+        return FakePaged([[SimpleNamespace(name="onecontainer-resource-1")]])
+
+    client = SimpleNamespace(resource_groups=SimpleNamespace(list=list_groups))
+    groups = [group.name for group in iter_resource_groups(client, role="deployment")]
+    assert groups == ["onecontainer-resource-1"]
+    assert filters == [f"tagName eq '{MANAGED_TAG}' and tagValue eq 'deployment'"]
+
+
+def test_azure_status_lists_tracked_and_untracked_groups(monkeypatch, capsys):
+    from types import SimpleNamespace
+
+    def resource_group(name):
+        return SimpleNamespace(
+            name=name, properties=SimpleNamespace(provisioning_state="Succeeded")
+        )
+
+    paged = FakePaged([[resource_group("onecontainer-rg-1"), resource_group("onecontainer-rg-2")]])
+    client = SimpleNamespace(resource_groups=SimpleNamespace(list=lambda filter: paged))
+    azure = service("azure")
+    azure.ini_conf["AZURE-service-1"] = {"resource": "onecontainer-rg-1", "ssh_ip": "u@1.2.3.4"}
+    monkeypatch.setattr(azure, "_get_resource_client", lambda: client)
+    azure.status()
+    assert capsys.readouterr().out.splitlines() == [
+        "onecontainer-rg-1: running, u@1.2.3.4",
+        "onecontainer-rg-2: untracked, Succeeded",
+    ]
+
+
+def test_azure_status_after_stop_no_wait_keeps_the_subscription(tmp_path, monkeypatch):
+    from types import SimpleNamespace
+
+    from onecontainer_cloud_tool import config, utils
+    from onecontainer_cloud_tool.cloud import m_azure
+
+    class Keys:
+        def delete_ssh_keys(self):
+            pass
+
+    class ResourceGroups:
+        def begin_delete(self, name):
+            return None
+
+        def check_existence(self, name):
+            return True
+
+        def list(self, filter):
+            return FakePaged([])
+
+    clients = []
+
+    def resource_client(credential, subscription_id):
+        clients.append((credential, subscription_id))
+        return SimpleNamespace(resource_groups=ResourceGroups())
+
+    def list_subscriptions(credential):
+        raise AssertionError("subscriptions listed instead of using the stored one")
+
+    config_file = tmp_path / "occ_config.ini"
+    config_file.write_text(
+        "[AZURE]\nregion = eastus\nsubscription_id = sub-2\ncredential_type = AzureCliCredential\n"
+        "\n[AZURE-service-1]\nresource = onecontainer-resource-1\n"
+    )
+    monkeypatch.setattr(config, "CONFIG_FILE", str(config_file))
+    monkeypatch.setattr(utils, "SSHkeys", Keys)
+    monkeypatch.setattr(m_azure, "CachedTokenCredential", lambda credential_type: credential_type)
+    monkeypatch.setattr(m_azure, "ResourceManagementClient", resource_client)
+    monkeypatch.setattr(m_azure, "SubscriptionClient", list_subscriptions)
+    service("azure").stop(no_wait=True)
+    service("azure").status()
+    assert clients == [("AzureCliCredential", "sub-2")] * 2
+    assert "onecontainer-resource-1" in config_file.read_text()
@@ -0,0 +1,76 @@
+"""cold start budget for the cli."""
+import subprocess
+import sys
+
+import pytest
+
+from onecontainer_cloud_tool.services import providers, provider_class
+
+CLOUD_SDKS = ("boto3", "botocore", "azure", "googleapiclient", "google.oauth2")
+
+_LOADED_SDKS = """
+import sys
+from onecontainer_cloud_tool.cli import cli
+try:
+    cli({args!r})
+except SystemExit:
+    pass
+sdks = {sdks!r}
+print("loaded:" + ",".join(sorted(m for m in sys.modules if m.split(".")[0] in sdks or m in sdks)))
+"""
+
+
+def _loaded_sdks(args):
+    script = _LOADED_SDKS.format(args=args, sdks=CLOUD_SDKS)
+    result = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, text=True, check=True
+    )
+    loaded = result.stdout.strip().splitlines()[-1][len("loaded:"):]
+    return [name for name in loaded.split(",") if name]
+
+
+@pytest.mark.parametrize("args", [["--help"], ["--version"], ["start", "--help"]])
+def test_cli_does_not_import_cloud_sdks(args):
+    assert _loaded_sdks(args) == []
+
+
+def test_unknown_provider():
+    with pytest.raises(NotImplementedError):
+        provider_class("openstack")
+
+
+def test_providers_registered():
+    assert providers() == ["aws", "azure", "gcp"]
+
+
+@pytest.mark.parametrize("backend", ["vm", "arm-template"])
+def test_azure_count_requires_scale_set(backend):
+    from click.testing import CliRunner
+
+    from onecontainer_cloud_tool.cli import cli
+
+    result = CliRunner().invoke(
+        cli, ["-c", "azure", "start", "-ci", "redis", "--count", "2", "--backend", backend]
+    )
+    assert result.exit_code == 2
+    assert "--backend scale-set" in result.output
+
+
+@pytest.mark.parametrize(
+    "cloud, option",
+    [
+        ("aws", ["--env", "MODE=cache"]),
+        ("aws", ["--run-flag", "--privileged"]),
+        ("gcp", ["--run-flag", "--privileged"]),
+        ("aws", ["--extra-image", "redis"]),
+        ("gcp", ["--extra-image", "redis"]),
+    ],
+)
+def test_start_rejects_options_the_cloud_ignores(cloud, option):
+    from click.testing import CliRunner
+
+    from onecontainer_cloud_tool.cli import cli
+
+    result = CliRunner().invoke(cli, ["-c", cloud, "start", "-ci", "nginx"] + option)
+    assert result.exit_code == 2
+    assert f"{option[0]} is not supported for {cloud}" in result.output
@@ -0,0 +1,47 @@
+import base64
+import gzip
+
+from onecontainer_cloud_tool import cloudinit
+from onecontainer_cloud_tool.cloudinit import Container
+
+
+def test_cloud_config_runs_every_container():
+    containers = (
+        Container("redis", env=["MODE=cache"], run_flags=["-p", "6379:6379"]),
+        Container("nginx"),
+    )
+    data = cloudinit.cloud_config(containers)
+    assert data.startswith("#cloud-config\n")
+    assert "  - docker.io" in data
+    assert '  - [ sh, -c, "docker run -td -e MODE=cache -p 6379:6379 redis" ]' in data
+    assert '  - [ sh, -c, "docker run -td nginx" ]' in data
+
+
+def test_bake_and_baked_payloads():
+    bake = cloudinit.cloud_config(pull_images=("redis", "nginx"))
+    assert "docker pull redis" in bake and "docker pull nginx" in bake
+    assert "docker run" not in bake
+    baked = cloudinit.cloud_config((Container("redis"),), install_docker=False)
+    assert "docker.io" not in baked and "docker run -td redis" in baked
+
+
+def test_custom_data_is_compressed_and_cached():
+    containers = (Container("redis", env=["A=1"]),)
+    data = cloudinit.custom_data(containers)
+    assert gzip.decompress(base64.b64decode(data)).decode() == cloudinit.cloud_config(containers)
+    # an equal container list is served from the cache
+    assert cloudinit.custom_data((Container("redis", env=("A=1",)),)) is data
+
+
+def test_shell_quoting_in_run_command():
+    container = Container("redis", env=['GREETING=hello "world"'])
+    data = cloudinit.cloud_config((container,))
+    assert "'GREETING=hello \\\"world\\\"'" in data
+
+
+def test_container_declaration_env():
+    declaration = cloudinit.container_declaration(
+        Container("redis", env=["MODE=cache"]), "occt-vm-instance"
+    )
+    assert '    - image: "redis"' in declaration
+    assert '        - name: "MODE"\n          value: "cache"' in declaration
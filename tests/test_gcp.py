@@ -0,0 +1,438 @@
+import socket
+
+import httplib2
+import pytest
+
+from onecontainer_cloud_tool.services import service
+
+
+class FakeRequest:
+    def __init__(self, response, connections=None):
+        self.response = response
+        self.connections = connections
+
+    def execute(self, http=None):
+        if self.connections is not None:
+            self.connections.append(http)
+        if isinstance(self.response, Exception):
+            raise self.response
+        return self.response
+
+
+class FakeZoneOperations:
+    def __init__(self, responses):
+        self.responses = responses
+        self.calls = []
+
+    def wait(self, project, zone, operation):
+        self.calls.append(operation)
+        return FakeRequest(self.responses[operation].pop(0))
+
+
+class FakeBatch:
+    def __init__(self, client, callback):
+        self.client = client
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self, http=None):
+        from googleapiclient.errors import HttpError
+
+        self.client.batches.append(len(self.requests))
+        for request_id, request in self.requests:
+            try:
+                self.callback(request_id, request.execute(http=http), None)
+            except HttpError as e:
+                self.callback(request_id, None, e)
+
+
+class FakeComputeClient:
+    def __init__(self, responses):
+        self.operations = FakeZoneOperations(responses)
+        self.batches = []
+
+    def zoneOperations(self):
+        return self.operations
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(self, callback)
+
+
+def gcp_with(responses):
+    gcp = service("gcp")
+    gcp.project_id = "project"
+    gcp.zone = "us-west1-a"
+    gcp.compute_client = FakeComputeClient(responses)
+    return gcp
+
+
+def test_gcp_waits_on_operations_server_side(monkeypatch):
+    from onecontainer_cloud_tool.cloud import gcp as gcp_module
+
+    sleeps = []
+    monkeypatch.setattr(gcp_module.time, "sleep", sleeps.append)
+    gcp = gcp_with(
+        {
+            "op-1": [{"status": "RUNNING"}, {"status": "DONE"}],
+            "op-2": [{"status": "DONE"}],
+        }
+    )
+    seen = []
+    results = gcp._wait_for_operations(["op-1", "op-2"], progress=seen.append)
+    assert set(results) == {"op-1", "op-2"}
+    assert gcp.compute_client.operations.calls == ["op-1", "op-2", "op-1"]
+    assert len(seen) == 3
+    assert len(sleeps) == 1 and 0 < sleeps[0] <= 1.0
+
+
+def test_gcp_wait_retries_throttling_and_raises_errors(monkeypatch):
+    import httplib2
+    from googleapiclient.errors import HttpError
+
+    from onecontainer_cloud_tool.cloud import gcp as gcp_module
+
+    monkeypatch.setattr(gcp_module.time, "sleep", lambda _: None)
+    throttled = HttpError(httplib2.Response({"status": 429}), b"rate limited")
+    gcp = gcp_with(
+        {"op-1": [throttled, {"status": "DONE", "error": {"errors": ["quota"]}}]}
+    )
+    with pytest.raises(Exception, match="quota"):
+        gcp._wait_for_operations(["op-1"])
+
+
+@pytest.mark.parametrize(
+    "failure",
+    [
+        "unavailable",
+        socket.timeout("timed out"),
+        ConnectionResetError("reset by peer"),
+        httplib2.ServerNotFoundError("compute.googleapis.com"),
+    ],
+)
+def test_gcp_wait_retries_a_failed_batch(monkeypatch, failure):
+    from googleapiclient.errors import HttpError
+
+    from onecontainer_cloud_tool.cloud import gcp as gcp_module
+
+    if failure == "unavailable":
+        failure = HttpError(httplib2.Response({"status": 503}), b"unavailable")
+
+    class FailedBatch(FakeBatch):
+        def execute(self, http=None):
+            raise failure
+
+    monkeypatch.setattr(gcp_module.time, "sleep", lambda _: None)
+    # the requests of the failed batch are built again for the retry
+    gcp = gcp_with({"op-1": [{"status": "DONE"}, {"status": "DONE"}]})
+    batches = [FailedBatch, FakeBatch]
+    gcp.compute_client.new_batch_http_request = lambda callback: batches.pop(0)(
+        gcp.compute_client, callback
+    )
+    assert set(gcp._wait_for_operations(["op-1"])) == {"op-1"}
+    assert batches == []
+
+
+def test_gcp_wait_deadline(monkeypatch):
+    from onecontainer_cloud_tool.cloud import gcp as gcp_module
+
+    monkeypatch.setattr(gcp_module.time, "sleep", lambda _: None)
+    gcp = gcp_with({"op-1": [{"status": "RUNNING"}] * 3})
+    with pytest.raises(TimeoutError):
+        gcp._wait_for_operations(["op-1"], timeout=0)
+
+
+
+def test_gcp_wait_deadline_checked_between_batches(monkeypatch):
+    from onecontainer_cloud_tool.cloud import gcp as gcp_module
+
+    import itertools
+
+    # deadline, round start, first batch, second batch, then past the deadline
+    clock = itertools.chain([0, 0, 5], itertools.repeat(20))
+    monkeypatch.setattr(gcp_module, "BATCH_SIZE", 1)
+    monkeypatch.setattr(gcp_module.time, "monotonic", lambda: next(clock))
+    gcp = gcp_with({"op-1": [{"status": "RUNNING"}], "op-2": [{"status": "RUNNING"}]})
+    with pytest.raises(TimeoutError):
+        gcp._wait_for_operations(["op-1", "op-2"], timeout=10)
+    assert gcp.compute_client.batches == [1]
+
+
+class FakeInstances:
+    def __init__(self):
+        self.calls = []
+
+    def insert(self, project, zone, body):
+        self.calls.append(("insert", body["name"]))
+        return FakeRequest({"name": f"op-{body['name']}"})
+
+    def delete(self, project, zone, instance):
+        self.calls.append(("delete", instance))
+        if instance.endswith("-gone"):
+            import httplib2
+            from googleapiclient.errors import HttpError
+
+            return FakeRequest(HttpError(httplib2.Response({"status": 404}), b"not found"))
+        return FakeRequest({"name": f"op-delete-{instance}"})
+
+
+class FakeBulkInstances(FakeInstances):
+    def bulkInsert(self, project, zone, body):
+        self.calls.append(("bulkInsert", sorted(body["perInstanceProperties"])))
+        assert body["instanceProperties"]["machineType"] == "n2-standard-2"
+        return FakeRequest({"name": "op-bulk"})
+
+
+class FakeImages:
+    def getFromFamily(self, project, family):
+        return FakeRequest({"selfLink": f"projects/{project}/global/images/{family}-1"})
+
+
+def deploying_gcp(instances):
+    gcp = gcp_with({})
+    gcp.compute_client.instances = lambda: instances
+    gcp.compute_client.images = lambda: FakeImages()
+    gcp.credentials = None
+    gcp.timestamp = 1700000000
+    gcp.machine_type = "n2-standard-2"
+    gcp.machine_image = "cos-stable"
+    gcp.image_project = "cos-cloud"
+    gcp.container_image_url = "redis"
+    gcp.env = ()
+    gcp.public_ssh_key = "ssh-rsa AAAA"
+    gcp.deployment_name = "occt-vm-1700000000"
+    gcp.instance_names = [f"occt-vm-1700000000-{index}" for index in range(3)]
+    return gcp
+
+
+def test_gcp_replicas_created_with_one_bulk_insert():
+    instances = FakeBulkInstances()
+    gcp = deploying_gcp(instances)
+    assert gcp._create_instances() == ["op-bulk"]
+    assert instances.calls == [("bulkInsert", gcp.instance_names)]
+
+
+def test_gcp_replicas_fall_back_to_concurrent_inserts():
+    instances = FakeInstances()
+    gcp = deploying_gcp(instances)
+    operations = gcp._create_instances()
+    assert operations == [f"op-{name}" for name in gcp.instance_names]
+    assert sorted(instances.calls) == [("insert", name) for name in gcp.instance_names]
+
+
+@pytest.mark.parametrize(
+    "status, message, fallback",
+    [
+        (404, b"method not found", True),
+        (400, b"bulkInsert is not supported", True),
+        (400, b"invalid machine type", False),
+        (403, b"quota exceeded", False),
+    ],
+)
+def test_gcp_replicas_fall_back_only_when_bulk_insert_unsupported(status, message, fallback):
+    import httplib2
+    from googleapiclient.errors import HttpError
+
+    class FailingBulkInstances(FakeInstances):
+        def bulkInsert(self, project, zone, body):
+            return FakeRequest(HttpError(httplib2.Response({"status": status}), message))
+
+    instances = FailingBulkInstances()
+    gcp = deploying_gcp(instances)
+    if fallback:
+        assert gcp._create_instances() == [f"op-{name}" for name in gcp.instance_names]
+    else:
+        with pytest.raises(SystemExit):
+            gcp._create_instances()
+        assert instances.calls == []
+
+
+def test_gcp_stop_deletes_every_recorded_instance(monkeypatch):
+    from onecontainer_cloud_tool import utils
+
+    class Keys:
+        def delete_ssh_keys(self):
+            pass
+
+    monkeypatch.setattr(utils, "SSHkeys", Keys)
+    instances = FakeInstances()
+    gcp = deploying_gcp(instances)
+    gcp.compute_client.operations.responses = {
+        "op-delete-occt-vm-1-0": [{"status": "DONE"}],
+        "op-delete-occt-vm-2-0": [{"status": "DONE"}],
+        "op-delete-occt-vm-instance": [{"status": "DONE"}],
+    }
+    gcp.ini_conf["GCP-service-1"] = {"instances": "occt-vm-1-0"}
+    gcp.ini_conf["GCP-service-2"] = {"instances": "occt-vm-2-0,occt-vm-2-gone"}
+    monkeypatch.setattr(gcp, "_get_compute_client", lambda: None)
+    monkeypatch.setattr(gcp, "_remove_config", lambda: None)
+    gcp.ini_conf["GCP"] = {"project_id": "project", "zone": "us-west1-a"}
+    gcp.stop()
+    assert sorted(name for _, name in instances.calls) == [
+        "occt-vm-1-0",
+        "occt-vm-2-0",
+        "occt-vm-2-gone",
+        "occt-vm-instance",
+    ]
+    assert not [section for section in gcp.ini_conf.sections() if "service" in section]
+
+
+def test_gcp_compute_client_and_discovery_document_cached(tmp_path, monkeypatch):
+    from onecontainer_cloud_tool.cloud import gcp as gcp_module
+    from onecontainer_cloud_tool.state import LocalState
+
+    builds = []
+    loads = []
+
+    class FakeDiscovery:
+        @staticmethod
+        def build(name, version, credentials):
+            builds.append((name, version))
+
+            class Built:
+                _rootDesc = {"name": "compute"}
+
+            return Built()
+
+        @staticmethod
+        def build_from_document(document, http):
+            return ("client", document["name"], http.credentials)
+
+    class FakeCredentials:
+        @staticmethod
+        def from_service_account_file(path):
+            loads.append(path)
+            return f"credentials-{path}"
+
+    monkeypatch.setattr(gcp_module.googleapiclient, "discovery", FakeDiscovery)
+    monkeypatch.setattr(gcp_module.service_account, "Credentials", FakeCredentials)
+    monkeypatch.setattr(gcp_module, "discovery_state", LocalState("discovery", directory=tmp_path))
+    monkeypatch.setattr(gcp_module, "_document", None)
+    monkeypatch.setattr(gcp_module, "_clients", {})
+
+    first = gcp_module.get_compute_client("key.json")
+    assert gcp_module.get_compute_client("key.json") is first
+    assert first[0] == ("client", "compute", "credentials-key.json")
+    assert builds == [("compute", "v1")] and loads == ["key.json"]
+
+    # a new process reads the stored document instead of building it
+    monkeypatch.setattr(gcp_module, "_document", None)
+    monkeypatch.setattr(gcp_module, "_clients", {})
+    gcp_module.get_compute_client("key.json")
+    assert builds == [("compute", "v1")]
+    assert gcp_module.discovery_state.get(gcp_module.DISCOVERY_VERSION) == {"name": "compute"}
+
+
+def test_gcp_instance_template_reused_for_identical_deploys():
+    import httplib2
+    from googleapiclient.errors import HttpError
+
+    class FakeTemplates:
+        def __init__(self):
+            self.templates = {}
+            self.inserted = []
+
+        def get(self, project, instanceTemplate):
+            if instanceTemplate in self.templates:
+                return FakeRequest({"selfLink": f"global/instanceTemplates/{instanceTemplate}"})
+            return FakeRequest(HttpError(httplib2.Response({"status": 404}), b"not found"))
+
+        def insert(self, project, body):
+            self.inserted.append(body["name"])
+            self.templates[body["name"]] = body
+            return FakeRequest(
+                {"name": "op-template", "targetLink": f"global/instanceTemplates/{body['name']}"}
+            )
+
+    class FakeGlobalOperations:
+        def wait(self, project, operation):
+            return FakeRequest({"status": "DONE"})
+
+    templates = FakeTemplates()
+    gcp = deploying_gcp(FakeInstances())
+    gcp.compute_client.instanceTemplates = lambda: templates
+    gcp.compute_client.globalOperations = lambda: FakeGlobalOperations()
+
+    first = gcp._ensure_instance_template()
+    gcp.timestamp = 1700000001
+    gcp.deployment_name = "occt-vm-1700000001"
+    assert gcp._ensure_instance_template() == first
+    assert len(templates.inserted) == 1
+    body = templates.templates[templates.inserted[0]]
+    assert body["properties"]["disks"][0]["initializeParams"]["sourceImage"] == (
+        "projects/cos-cloud/global/images/family/cos-stable"
+    )
+    gcp.env = ("MODE=cache",)
+    assert gcp._ensure_instance_template() != first
+    assert len(templates.inserted) == 2
+
+
+def test_gcp_status_fetches_instances_in_batches(monkeypatch, capsys):
+    from onecontainer_cloud_tool.cloud import gcp as gcp_module
+
+    class FakeGetInstances(FakeInstances):
+        def get(self, project, zone, instance):
+            if instance.endswith("-gone"):
+                import httplib2
+                from googleapiclient.errors import HttpError
+
+                return FakeRequest(HttpError(httplib2.Response({"status": 404}), b"not found"))
+            return FakeRequest(
+                {
+                    "status": "RUNNING",
+                    "networkInterfaces": [{"accessConfigs": [{"natIP": f"10.0.0.{instance[-1]}"}]}],
+                }
+            )
+
+    monkeypatch.setattr(gcp_module, "BATCH_SIZE", 2)
+    gcp = deploying_gcp(FakeGetInstances())
+    monkeypatch.setattr(gcp, "_get_compute_client", lambda: None)
+    gcp.ini_conf["GCP"] = {"project_id": "project", "zone": "us-west1-a"}
+    gcp.ini_conf["GCP-service-1"] = {"instances": "occt-vm-1-0,occt-vm-1-1,occt-vm-1-gone"}
+    gcp.status()
+    assert gcp.compute_client.batches == [2, 1]
+    out = capsys.readouterr().out
+    assert "occt-vm-1-1: RUNNING, 10.0.0.1" in out
+    assert "occt-vm-1-gone: deleted" in out
+
+
+def test_gcp_instance_group_recorded_before_waiting(tmp_path, monkeypatch):
+    import threading
+
+    from onecontainer_cloud_tool import config
+    from onecontainer_cloud_tool.cloud import gcp as gcp_module
+
+    connections = []
+
+    class FakeGlobalResources:
+        def get(self, project, **name):
+            return FakeRequest({"selfLink": f"global/{list(name.values())[0]}"}, connections)
+
+    class FakeGroupManagers:
+        def insert(self, project, zone, body):
+            return FakeRequest({"name": "op-group"})
+
+    monkeypatch.setattr(gcp_module, "authorized_http", lambda _: threading.get_ident())
+    monkeypatch.setattr(config, "CONFIG_FILE", str(tmp_path / "occ_config.ini"))
+    gcp = deploying_gcp(FakeInstances())
+    gcp.username = "occt-user"
+    gcp.instance_group = "occt-group-1700000000"
+    gcp.compute_client.instanceTemplates = FakeGlobalResources
+    gcp.compute_client.healthChecks = FakeGlobalResources
+    gcp.compute_client.firewalls = FakeGlobalResources
+    gcp.compute_client.instanceGroupManagers = FakeGroupManagers
+    gcp.compute_client.operations.responses = {"op-group": [{"status": "DONE"}]}
+
+    def timeout(progress=None):
+        raise TimeoutError("not stable")
+
+    monkeypatch.setattr(gcp, "_wait_for_group", timeout)
+    with pytest.raises(TimeoutError):
+        gcp._create_instance_group(2)
+    # every concurrent lookup got a connection of its own thread
+    assert len(connections) == 3 and None not in connections
+    section = gcp.ini_conf["GCP-service-1700000000"]
+    assert section["instance_group"] == "occt-group-1700000000"
+    assert gcp._deployed_resources() == ([], ["occt-group-1700000000"])
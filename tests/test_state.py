@@ -0,0 +1,27 @@
+import time
+
+from onecontainer_cloud_tool.state import LocalState
+
+
+def test_state_round_trip(tmp_path):
+    state = LocalState("test", directory=tmp_path)
+    assert state.get("us-east-1") is None
+    state.set("us-east-1", {"vpc_id": "vpc-1"})
+    assert LocalState("test", directory=tmp_path).get("us-east-1") == {"vpc_id": "vpc-1"}
+    state.delete("us-east-1")
+    assert state.get("us-east-1") is None
+
+
+def test_state_expires(tmp_path, monkeypatch):
+    state = LocalState("test", directory=tmp_path)
+    state.set("key", "value")
+    assert state.get("key", ttl=60) == "value"
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 120)
+    assert state.get("key", ttl=60) is None
+    assert state.get("key") == "value"
+
+
+def test_state_ignores_corrupt_file(tmp_path):
+    (tmp_path / "test.json").write_text("{not json")
+    assert LocalState("test", directory=tmp_path).get("key") is None
@@ -0,0 +1,68 @@
+import threading
+import time
+
+import pytest
+
+from onecontainer_cloud_tool.step_graph import Step, StepGraph
+
+
+def test_steps_respect_requirements():
+    order = []
+    lock = threading.Lock()
+
+    def record(name):
+        def run():
+            with lock:
+                order.append(name)
+            return name
+        return run
+
+    graph = StepGraph(
+        [
+            Step("service", record("service"), requires=["cluster", "task"]),
+            Step("cluster", record("cluster")),
+            Step("task", record("task")),
+        ]
+    )
+    results = graph.run()
+    assert results == {"service": "service", "cluster": "cluster", "task": "task"}
+    assert order[-1] == "service"
+
+
+def test_independent_steps_run_concurrently():
+    barrier = threading.Barrier(2, timeout=5)
+    graph = StepGraph([Step("a", barrier.wait), Step("b", barrier.wait)])
+    graph.run()
+
+
+def test_failure_stops_dependants():
+    ran = []
+
+    def fail():
+        raise RuntimeError("boom")
+
+    graph = StepGraph(
+        [Step("a", fail), Step("b", lambda: ran.append("b"), requires=["a"])]
+    )
+    with pytest.raises(RuntimeError):
+        graph.run()
+    assert ran == []
+
+
+def test_cycles_and_unknown_steps_are_rejected():
+    with pytest.raises(ValueError):
+        StepGraph([Step("a", print, requires=["b"]), Step("b", print, requires=["a"])])
+    with pytest.raises(ValueError):
+        StepGraph([Step("a", print, requires=["missing"])])
+
+
+def test_critical_path():
+    graph = StepGraph(
+        [
+            Step("slow", lambda: time.sleep(0.2)),
+            Step("fast", lambda: None),
+            Step("last", lambda: None, requires=["slow", "fast"]),
+        ]
+    )
+    graph.run()
+    assert [step.name for step in graph.critical_path()] == ["slow", "last"]
@@ -5,3 +5,24 @@ def test_version():
     assert __version__ == "0.2.0"
 
 
+
+
+def test_version_without_importlib_metadata(monkeypatch):
+    import importlib
+    import sys
+    import types
+
+    import onecontainer_cloud_tool as package
+
+    fake = types.ModuleType("pkg_resources")
+    fake.DistributionNotFound = type("DistributionNotFound", (Exception,), {})
+    fake.get_distribution = lambda name: types.SimpleNamespace(version="1.2.3")
+    # python 3.7 without the importlib-metadata backport
+    monkeypatch.setitem(sys.modules, "importlib.metadata", None)
+    monkeypatch.setitem(sys.modules, "importlib_metadata", None)
+    monkeypatch.setitem(sys.modules, "pkg_resources", fake)
+    try:
+        assert importlib.reload(package).__version__ == "1.2.3"
+    finally:
+        monkeypatch.undo()
+        importlib.reload(package)